@@ -0,0 +1,113 @@
+import heapq
+import threading
+from datetime import datetime
+
+
+class TopK:
+    """Approximate top-k counter (Space-Saving) holding at most `capacity` keys.
+
+    Any key seen more than n/capacity times is guaranteed to be kept, and a
+    kept key's count overestimates its true count by at most the count of the
+    key it evicted. Safe to share between threads.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        # (count, key) min-heap; entries whose count is stale are skipped lazily
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def add(self, key, count=1):
+        with self._lock:
+            self._add(key, count)
+
+    def _add(self, key, count):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+        else:
+            # Replace the current minimum and inherit its count
+            floor = self.counts.pop(self._pop_min())
+            self.counts[key] = floor + count
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key
+
+    def most_common(self, n=None):
+        with self._lock:
+            counts = list(self.counts.items())
+        ranked = sorted(counts, key=lambda entry: (-entry[1], entry[0]))
+        return ranked if n is None else ranked[:n]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+# Apify post item types -> content mix buckets
+INSTAGRAM_POST_TYPES = {'Image': 'image', 'Video': 'video', 'Sidecar': 'carousel'}
+
+
+class InstagramPostStats:
+    """Running aggregate over a profile's Apify post items, fed as they arrive.
+
+    Memory stays constant in the number of posts: only totals, the media mix,
+    the first/last timestamps and a bounded hashtag counter are kept. Callers
+    that store post records (the incremental-refresh window) bound those
+    separately.
+    """
+
+    def __init__(self, hashtag_capacity=100):
+        self.posts = 0
+        self.likes = 0
+        self.comments = 0
+        self.video_views = 0
+        self.post_types = dict.fromkeys(INSTAGRAM_POST_TYPES.values(), 0)
+        self.hashtags = TopK(hashtag_capacity)
+        self.newest = None
+        self.oldest = None
+
+    def add(self, item):
+        # Profile-only items (no post id) carry no post metrics
+        if not item.get('id') and not item.get('shortCode'):
+            return
+        self.posts += 1
+        # Hidden like counts are reported as -1
+        self.likes += max(item.get('likesCount') or 0, 0)
+        self.comments += max(item.get('commentsCount') or 0, 0)
+        self.video_views += max(item.get('videoViewCount') or 0, 0)
+        post_type = INSTAGRAM_POST_TYPES.get(item.get('type'), 'image')
+        self.post_types[post_type] += 1
+        for hashtag in dict.fromkeys(tag.lower() for tag in item.get('hashtags') or []):
+            self.hashtags.add(hashtag)
+        timestamp = item.get('timestamp')
+        if timestamp:
+            posted_at = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            self.newest = posted_at if self.newest is None else max(self.newest, posted_at)
+            self.oldest = posted_at if self.oldest is None else min(self.oldest, posted_at)
+
+    def summary(self, followers, top_hashtags=10):
+        # Engagement rate: average likes + comments per post, as a share of followers
+        interactions = (self.likes + self.comments) / self.posts if self.posts else 0
+        span_days = (self.newest - self.oldest).total_seconds() / 86400 if self.newest else 0
+        return {
+            'posts_analyzed': self.posts,
+            'total_likes': self.likes,
+            'total_comments': self.comments,
+            'total_video_views': self.video_views,
+            'avg_likes': round(self.likes / self.posts) if self.posts else 0,
+            'avg_comments': round(self.comments / self.posts) if self.posts else 0,
+            'avg_engagement_rate': round(interactions / followers * 100, 2) if followers else 0.0,
+            'post_types': dict(self.post_types),
+            'top_hashtags': dict(self.hashtags.most_common(top_hashtags)),
+            'posts_per_week': round((self.posts - 1) / span_days * 7, 2) if span_days > 0 else 0.0,
+            'latest_post_at': self.newest.isoformat() if self.newest else None,
+        }
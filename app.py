@@ -1,154 +1,631 @@
 import streamlit as st
 import os
-from langchain.chat_models import ChatOpenAI
+import re
+import asyncio
+import math
+import csv
+import json
+import hashlib
+import socket
+import threading
+import time
+import functools
+import itertools
+import contextvars
+import dataclasses
+import difflib
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
-from langchain.llms import OpenAI
-from langchain.agents import initialize_agent, Tool
-from langchain.agents import AgentType
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-import instaloader
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-import pickle
-from isodate import parse_duration
-from datetime import datetime, timedelta
-import requests
-from unsplash.api import Api
-from unsplash.auth import Auth
-from apify_client import ApifyClient
-# Load environment variables
-load_dotenv()
-
-# Initialize Instagram loader
-client = ApifyClient(os.getenv('APIFY_API_TOKEN'))
+from analytics import InstagramPostStats, TopK
+from cache import MemoryCache, SingleFlight, SQLiteCache, merge_cache_stats
+from jobs import FINISHED, JobQueue
+from metrics import REGISTRY, Registry, SQLiteMetricsStore, span, start_http_server, start_publisher, traced
+from providers import CostHint, ProfileProvider
+from scheduler import (PRIORITY_BATCH, QuotaBudget, RequestScheduler, SQLiteLimitStore, merge_scheduler_stats,
+                       request_priority)
+from tokens import clean_text, count_tokens, dedupe_lines, truncate_tokens
+from urls import ProfileRef, parse_profile_url
 
-def get_instagram_info(username):
+# Heavy client libraries (langchain, googleapiclient, apify_client, unsplash,
+# tweepy, TikTokApi) are
+# imported lazily on the code path that needs them, and clients are created once
+# per process through st.cache_resource, because Streamlit re-executes this
+# script on every interaction.
+
+@st.cache_resource
+def load_environment():
+    # Load environment variables
+    load_dotenv()
+
+load_environment()
+
+# Profile cache settings (TTLs in seconds, per platform)
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', '.cache/analyzer.sqlite')
+PROFILE_CACHE_BACKEND = os.getenv('PROFILE_CACHE_BACKEND', 'sqlite')
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', 5000))
+PROFILE_CACHE_TTLS = {
+    'instagram': int(os.getenv('INSTAGRAM_CACHE_TTL', 6 * 3600)),
+    'youtube': int(os.getenv('YOUTUBE_CACHE_TTL', 12 * 3600)),
+    'twitter': int(os.getenv('TWITTER_CACHE_TTL', 6 * 3600)),
+    'tiktok': int(os.getenv('TIKTOK_CACHE_TTL', 6 * 3600)),
+}
+
+# Per-creator snapshots (fetched posts/videos and aggregates) that later fetches
+# extend with only newer items ('incremental') instead of re-crawling ('full')
+PROFILE_REFRESH_MODE = os.getenv('PROFILE_REFRESH_MODE', 'incremental')
+SNAPSHOT_TTL = int(os.getenv('SNAPSHOT_TTL', 90 * 24 * 3600))
+SNAPSHOT_MAX_ENTRIES = int(os.getenv('SNAPSHOT_MAX_ENTRIES', 100000))
+
+# Apify Instagram scraper actor and how many usernames to pack into one run
+INSTAGRAM_ACTOR_ID = "shu8hvrXbJbY3Eb9W"
+INSTAGRAM_BATCH_SIZE = int(os.getenv('INSTAGRAM_BATCH_SIZE', 25))
+# Recent posts scraped per profile for post analytics, and how many distinct
+# hashtags the bounded top-k counter tracks per profile
+INSTAGRAM_POSTS_LIMIT = int(os.getenv('INSTAGRAM_POSTS_LIMIT', 100))
+INSTAGRAM_HASHTAG_CAPACITY = int(os.getenv('INSTAGRAM_HASHTAG_CAPACITY', 200))
+# Incremental refreshes also re-fetch posts from the INSTAGRAM_DELTA_OVERLAP_DAYS
+# before the newest stored post, whose counts are still growing. Older posts and
+# the profile fields of inactive creators are refreshed by a full fetch once the
+# last one is INSTAGRAM_FULL_REFRESH_AGE seconds old.
+INSTAGRAM_DELTA_OVERLAP_DAYS = int(os.getenv('INSTAGRAM_DELTA_OVERLAP_DAYS', 2))
+INSTAGRAM_FULL_REFRESH_AGE = int(os.getenv('INSTAGRAM_FULL_REFRESH_AGE', 24 * 3600))
+
+# YouTube: how many recent uploads to pull and how long handle lookups are memoized
+YOUTUBE_RECENT_VIDEOS = int(os.getenv('YOUTUBE_RECENT_VIDEOS', 10))
+# Uploads enriched with statistics for channel-level engagement, and how many
+# videos().list batches run in parallel (per process, shared by all fetches)
+YOUTUBE_ENRICH_VIDEOS = int(os.getenv('YOUTUBE_ENRICH_VIDEOS', 50))
+YOUTUBE_ENRICH_CONCURRENCY = int(os.getenv('YOUTUBE_ENRICH_CONCURRENCY', 4))
+YOUTUBE_SHORTS_MAX_SECONDS = int(os.getenv('YOUTUBE_SHORTS_MAX_SECONDS', 60))
+YOUTUBE_HANDLE_TTL = int(os.getenv('YOUTUBE_HANDLE_TTL', 7 * 24 * 3600))
+
+# Twitter/X: users looked up per API call (max 100) and recent tweets per profile
+# for engagement (5-100, retweets and replies excluded)
+TWITTER_BATCH_SIZE = int(os.getenv('TWITTER_BATCH_SIZE', 100))
+TWITTER_RECENT_TWEETS = int(os.getenv('TWITTER_RECENT_TWEETS', 20))
+TWITTER_CONCURRENCY = int(os.getenv('TWITTER_CONCURRENCY', 4))
+
+# TikTok (optional TikTokApi package): profiles fetched per browser session and
+# recent videos per profile for engagement
+TIKTOK_BATCH_SIZE = int(os.getenv('TIKTOK_BATCH_SIZE', 10))
+TIKTOK_RECENT_VIDEOS = int(os.getenv('TIKTOK_RECENT_VIDEOS', 30))
+
+# Recommendation LLM and its response cache ('exact' or 'semantic' keys)
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-3.5-turbo')
+LLM_TEMPERATURE = float(os.getenv('LLM_TEMPERATURE', 0.7))
+RECOMMENDATION_CACHE_MODE = os.getenv('RECOMMENDATION_CACHE_MODE', 'exact')
+# Stored recommendations are reused while the (normalized) profile summary
+# differs by less than this fraction from the one they were generated for;
+# 0 always regenerates
+RECOMMENDATION_REFRESH_THRESHOLD = float(os.getenv('RECOMMENDATION_REFRESH_THRESHOLD', 0.1))
+# 'text' (the "Product N:" format) or 'json' (OpenAI JSON mode with a schema)
+RECOMMENDATION_OUTPUT_MODE = os.getenv('RECOMMENDATION_OUTPUT_MODE', 'text')
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', 7 * 24 * 3600))
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', 20000))
+
+# Token budget for the filled-in recommendation prompt (the reply needs room in
+# the model's context too). Free-text fields (bios, descriptions) are capped at
+# PROMPT_FIELD_TOKENS and up to PROMPT_VIDEO_DESCRIPTIONS recent video
+# descriptions are included; both shrink until the prompt fits the budget.
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 1500))
+PROMPT_FIELD_TOKENS = int(os.getenv('PROMPT_FIELD_TOKENS', 150))
+PROMPT_MIN_FIELD_TOKENS = 20
+PROMPT_VIDEO_DESCRIPTIONS = int(os.getenv('PROMPT_VIDEO_DESCRIPTIONS', 5))
+# LLM requests kept with their token counts for the sidebar
+TOKEN_USAGE_LOG_SIZE = 200
+
+# Per-provider rate limits as (requests per second, burst size)
+API_RATE_LIMITS = {
+    'apify': (float(os.getenv('APIFY_RATE_PER_SEC', 1)), 5),
+    'youtube': (float(os.getenv('YOUTUBE_RATE_PER_SEC', 10)), 20),
+    'unsplash': (float(os.getenv('UNSPLASH_RATE_PER_HOUR', 50)) / 3600, 10),
+    'openai': (float(os.getenv('OPENAI_RATE_PER_MIN', 60)) / 60, 10),
+    'twitter': (float(os.getenv('TWITTER_RATE_PER_MIN', 20)) / 60, 5),
+    'tiktok': (float(os.getenv('TIKTOK_RATE_PER_MIN', 10)) / 60, 3),
+}
+# Share of each provider's burst that batch-priority calls (bulk analysis,
+# prefetch) leave for interactive ones, in every process sharing the limits
+BATCH_RESERVE_SHARE = float(os.getenv('BATCH_RESERVE_SHARE', 0.5))
+API_BATCH_RESERVES = {provider: capacity * BATCH_RESERVE_SHARE for provider, (_, capacity) in API_RATE_LIMITS.items()}
+# Unsplash refills slowly (about one search per 72s), so its reserve always
+# covers the image searches of one interactive analysis (one per product)
+UNSPLASH_INTERACTIVE_RESERVE = int(os.getenv('UNSPLASH_INTERACTIVE_RESERVE', 5))
+API_BATCH_RESERVES['unsplash'] = max(API_BATCH_RESERVES['unsplash'], UNSPLASH_INTERACTIVE_RESERVE)
+YOUTUBE_DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA', 10000))
+# Quota units charged by the YouTube Data API per method
+YOUTUBE_QUOTA_COSTS = {
+    'channels.list': 1,
+    'playlistItems.list': 1,
+    'videos.list': 1,
+    'search.list': 100,
+}
+# How long an image lookup may wait for an Unsplash slot before giving up
+UNSPLASH_WAIT_TIMEOUT = float(os.getenv('UNSPLASH_WAIT_TIMEOUT', 10))
+
+# Port for the Prometheus /metrics exporter (disabled when unset), and how
+# often each process (web and workers) publishes its metrics for the totals
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_INTERVAL', 10))
+
+# Maximum number of analyses a single AnalysisEngine runs at once
+ENGINE_MAX_CONCURRENCY = int(os.getenv('ENGINE_MAX_CONCURRENCY', 8))
+
+# Where "Analyze Profile" runs: 'inline' (in the web process), 'queue' (as a
+# job for worker.py processes) or 'auto' (queue while a worker is alive)
+ANALYSIS_BACKEND = os.getenv('ANALYSIS_BACKEND', 'auto')
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', '.cache/jobs.sqlite')
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 120))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))
+
+# Maximum number of Unsplash searches in flight per analysis
+UNSPLASH_MAX_CONCURRENCY = int(os.getenv('UNSPLASH_MAX_CONCURRENCY', 5))
+
+# Unsplash results are cached per normalized keyword set; one search fetches
+# enough photos for any count the app asks for
+UNSPLASH_CACHE_TTL = int(os.getenv('UNSPLASH_CACHE_TTL', 7 * 24 * 3600))
+UNSPLASH_EMPTY_TTL = int(os.getenv('UNSPLASH_EMPTY_TTL', 24 * 3600))
+UNSPLASH_CACHE_MAX_ENTRIES = int(os.getenv('UNSPLASH_CACHE_MAX_ENTRIES', 5000))
+UNSPLASH_PHOTOS_PER_SEARCH = 10
+# Keyword sets kept warm in the background (';'-separated), plus the most
+# requested sets seen by this process; at most UNSPLASH_PREFETCH_LIMIT
+# searches per round, one round every UNSPLASH_PREFETCH_INTERVAL seconds
+UNSPLASH_POPULAR_KEYWORDS = os.getenv('UNSPLASH_POPULAR_KEYWORDS', ';'.join([
+    'laptop, workspace, productivity',
+    'online course, laptop, learning',
+    'ebook, reading, tablet',
+    'planner, notebook, desk',
+    'fitness, workout, gym',
+    'camera, content creation, studio',
+    'community, people, membership',
+    'cooking, recipe, kitchen',
+])).split(';')
+UNSPLASH_PREFETCH_LIMIT = int(os.getenv('UNSPLASH_PREFETCH_LIMIT', 10))
+UNSPLASH_PREFETCH_INTERVAL = int(os.getenv('UNSPLASH_PREFETCH_INTERVAL', 3600))
+
+@st.cache_resource
+def get_apify_client():
+    from apify_client import ApifyClient
+    return ApifyClient(os.getenv('APIFY_API_TOKEN'))
+
+@st.cache_resource
+def get_unsplash_api():
+    from unsplash.api import Api
+    from unsplash.auth import Auth
+    return Api(Auth(os.getenv('UNSPLASH_ACCESS_KEY')))
+
+@st.cache_resource
+def get_scheduler():
+    # One scheduler per process so every session and batch job shares the limits;
+    # bucket and quota state live in SQLite, so the web and worker processes
+    # share them too
+    store = SQLiteLimitStore(CACHE_DB_PATH)
+    scheduler = RequestScheduler(API_RATE_LIMITS, store=store, reserves=API_BATCH_RESERVES)
+    scheduler.set_quota('youtube', QuotaBudget(YOUTUBE_DAILY_QUOTA, store=store, name='youtube'))
+    return scheduler
+
+def youtube_execute(request, method):
+    with span(f'youtube.{method}'):
+        return get_scheduler().call('youtube', request.execute, units=YOUTUBE_QUOTA_COSTS[method])
+
+@st.cache_resource
+def get_profile_cache():
+    # Shared across sessions and reruns so hit-rate metrics accumulate per process
+    if PROFILE_CACHE_BACKEND == 'memory':
+        return MemoryCache(max_entries=PROFILE_CACHE_MAX_ENTRIES, name='profiles')
+    return SQLiteCache(CACHE_DB_PATH, 'profiles', max_entries=PROFILE_CACHE_MAX_ENTRIES)
+
+@st.cache_resource
+def get_snapshot_store():
+    # Keys: 'profile:<profile key>' and 'recommendation:<profile key>'
+    return SQLiteCache(CACHE_DB_PATH, 'snapshots', max_entries=SNAPSHOT_MAX_ENTRIES, default_ttl=SNAPSHOT_TTL)
+
+def load_snapshot(kind, profile_key):
+    if PROFILE_REFRESH_MODE != 'incremental':
+        return None
+    return get_snapshot_store().get(f'{kind}:{profile_key}')
+
+def save_snapshot(kind, profile_key, snapshot):
+    get_snapshot_store().set(f'{kind}:{profile_key}', snapshot)
+
+@st.cache_resource
+def get_profile_flight():
+    # Process-wide, so sessions fetching the same profile at once share one fetch
+    return SingleFlight('profiles')
+
+def normalize_instagram_username(username):
+    # Remove '@' if present; Instagram usernames are case-insensitive
+    return username.strip().lstrip('@').lower()
+
+def instagram_run_input(usernames, newer_than=None):
+    # Prepare the Actor input; one run accepts many profile URLs. newer_than
+    # (ISO timestamp) limits the run to recent posts, at day granularity.
+    run_input = {
+        "directUrls": [f"https://www.instagram.com/{username}/" for username in usernames],
+        "resultsType": "posts",
+        "resultsLimit": INSTAGRAM_POSTS_LIMIT,
+        "searchType": "user",
+        "searchLimit": 1,
+        "addParentData": True,
+    }
+    if newer_than:
+        run_input["onlyPostsNewerThan"] = newer_than[:10]
+    return run_input
+
+def instagram_profile_fields(item):
+    # Parent profile data is repeated on every post item
+    return {
+        'username': item.get('username', ''),
+        'fullName': item.get('fullName', ''),
+        'biography': item.get('biography', ''),
+        'followersCount': item.get('followersCount'),
+        'followsCount': item.get('followsCount'),
+        'postsCount': item.get('postsCount')
+    }
+
+def instagram_post_record(item):
+    # Fields InstagramPostStats reads from a post item, kept in the snapshot window
+    return {field: item.get(field) for field in
+            ('id', 'shortCode', 'type', 'timestamp', 'likesCount', 'commentsCount', 'videoViewCount', 'hashtags')}
+
+def instagram_post_window(posts):
+    # Snapshot window: the INSTAGRAM_POSTS_LIMIT most recent post records, newest first
+    return sorted(posts, key=lambda post: post.get('timestamp') or '', reverse=True)[:INSTAGRAM_POSTS_LIMIT]
+
+def instagram_item_username(item):
+    # Items carry the directUrl that produced them, which identifies the requested profile
+    input_url = item.get('inputUrl') or item.get('url') or ''
+    if 'instagram.com/' in input_url:
+        return normalize_instagram_username(input_url.split('instagram.com/')[1].split('/')[0].split('?')[0])
+    return normalize_instagram_username(item.get('ownerUsername') or item.get('username') or '')
+
+def fetch_instagram_profiles(usernames, batch_size=INSTAGRAM_BATCH_SIZE):
+    # Fetch many profiles with one Actor run per batch of usernames. Returns
+    # {username: profile_data} where failed usernames map to an error string.
+    # Profiles with a recent snapshot only fetch posts since shortly before the
+    # newest post in its window; snapshots without a timestamped post, or whose
+    # last full fetch is older than INSTAGRAM_FULL_REFRESH_AGE, fetch in full.
+    usernames = list(dict.fromkeys(normalize_instagram_username(username) for username in usernames))
+    snapshots = {}
+    for username in usernames:
+        snapshot = load_snapshot('profile', ProfileRef('instagram', 'username', username).key)
+        if (snapshot and snapshot.get('posts') and snapshot['posts'][0].get('timestamp')
+                and time.time() - snapshot.get('full_fetched_at', 0) < INSTAGRAM_FULL_REFRESH_AGE):
+            snapshots[username] = snapshot
+    full = [username for username in usernames if username not in snapshots]
+    delta = [username for username in usernames if username in snapshots]
+
+    results = {}
+    for group in (full, delta):
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            results.update(fetch_instagram_batch(batch, {username: snapshots[username] for username in batch
+                                                         if username in snapshots}))
+    return results
+
+def fetch_instagram_batch(batch, snapshots):
+    results = {}
+    wanted = set(batch)
+    # Post analytics are aggregated as items arrive; only the records of the
+    # newest INSTAGRAM_POSTS_LIMIT posts are kept (by id) for the snapshot
+    post_stats = {username: InstagramPostStats(INSTAGRAM_HASHTAG_CAPACITY) for username in snapshots}
+    windows = {username: {} for username in snapshots}
+    # One run serves the whole batch, so it starts at the oldest snapshot, less
+    # the overlap whose counts are refreshed
+    newer_than = min(
+        datetime.fromisoformat(snapshot['posts'][0]['timestamp'].replace('Z', '+00:00'))
+        for snapshot in snapshots.values()
+    ) - timedelta(days=INSTAGRAM_DELTA_OVERLAP_DAYS) if snapshots else None
     try:
-        # Remove '@' if present
-        username = username.lstrip('@')
-        
-        print('searching for this username = ', username)
-        
-        # Prepare the Actor input
-        run_input = {
-            "directUrls": [f"https://www.instagram.com/{username}/"],
-            "resultsType": "posts",
-            "resultsLimit": 1,  # Limit to last 20 posts for performance
-            "searchType": "user",
-            "searchLimit": 1,
-            "addParentData": True,
-        }
-        
+        client = get_apify_client()
         # Run the Actor and wait for it to finish
-        run = client.actor("shu8hvrXbJbY3Eb9W").call(run_input=run_input)
-        
-        # Initialize counters and data structures
-        hashtags = {}
-        post_types = {'image': 0, 'video': 0}
-        total_likes = 0
-        total_comments = 0
-        post_count = 0
-        profile_data = None
-        
-        # Process the results
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-            username = item.get('username', '')
-            bio = item.get('biography', '')
-            followerCount = item.get('followersCount')
-            followsCount = item.get('followsCount')
-            postsCount = item.get('postsCount')
-            post_count = postsCount
-            profile_data = {
-                'username': username,
-                'fullName': item.get('fullName', ''),
-                'biography': bio,
-                'followersCount': followerCount,
-                'followsCount': followsCount,
-                'postsCount': postsCount
-            }
-                
-        
-        if not profile_data:
-            return "Error: Could not fetch profile data"
+        with span('apify.actor_run', detail=','.join(batch), refresh='delta' if newer_than else 'full'):
+            run = get_scheduler().call('apify', client.actor(INSTAGRAM_ACTOR_ID).call,
+                                       run_input=instagram_run_input(batch, newer_than and newer_than.isoformat()))
 
-        return profile_data
+        # Stream the results, routing each item back to the username it belongs to
+        with span('apify.dataset_iterate', detail=run["defaultDatasetId"]):
+            for item in client.dataset(run["defaultDatasetId"]).iterate_items():
+                username = instagram_item_username(item)
+                if username not in wanted:
+                    continue
+                if item.get('error'):
+                    if not isinstance(results.get(username), dict):
+                        results[username] = f"Error fetching Instagram profile: {item.get('errorDescription') or item['error']}"
+                    continue
+                if not isinstance(results.get(username), dict):
+                    results[username] = instagram_profile_fields(item)
+                    post_stats.setdefault(username, InstagramPostStats(INSTAGRAM_HASHTAG_CAPACITY))
+                    windows.setdefault(username, {})
+                # Profile-only items (no post id) carry no post metrics. The
+                # scraper returns newest posts first, so the first
+                # INSTAGRAM_POSTS_LIMIT are the window.
+                post_id = item.get('id') or item.get('shortCode')
+                if post_id and post_id not in windows[username] and len(windows[username]) < INSTAGRAM_POSTS_LIMIT:
+                    post_stats[username].add(item)
+                    windows[username][post_id] = instagram_post_record(item)
     except Exception as e:
-        return f"Error fetching Instagram profile: {str(e)}"
-    
+        for username in batch:
+            results.setdefault(username, f"Error fetching Instagram profile: {str(e)}")
 
-def get_youtube_info(channel_url):
-    try:
+    for username, snapshot in snapshots.items():
+        # No posts in the overlap: the run returns no items, so the stored
+        # profile fields are reused until the next full fetch
+        if username not in results:
+            results[username] = dict(snapshot['profile'])
+        # Stored posts older than the run fill the rest of the window
+        window = windows[username]
+        for post in snapshot['posts']:
+            if len(window) >= INSTAGRAM_POSTS_LIMIT:
+                break
+            post_id = post['id'] or post['shortCode']
+            if post_id not in window:
+                post_stats[username].add(post)
+                window[post_id] = post
+    for username, stats in post_stats.items():
+        if isinstance(results.get(username), dict):
+            profile = {key: results[username][key] for key in instagram_profile_fields({})}
+            results[username].update(stats.summary(profile['followersCount']))
+            results[username]['profile_key'] = ProfileRef('instagram', 'username', username).key
+            full_fetched_at = snapshots[username]['full_fetched_at'] if username in snapshots else time.time()
+            save_snapshot('profile', results[username]['profile_key'], {
+                'profile': profile,
+                'posts': instagram_post_window(windows[username].values()),
+                'full_fetched_at': full_fetched_at,
+            })
+
+    for username in batch:
+        results.setdefault(username, "Error: Could not fetch profile data")
+    return results
+
+def get_instagram_info(username):
+    username = normalize_instagram_username(username)
+    return get_provider('instagram').fetch(
+        {'platform': 'instagram', 'username': username, 'key': ProfileRef('instagram', 'username', username).key})
+
+
+@st.cache_resource
+def _youtube_clients():
+    # googleapiclient resources are not thread-safe, so each thread gets its own
+    # long-lived client instead of one shared instance
+    return threading.local()
+
+def get_youtube_client():
+    clients = _youtube_clients()
+    if not hasattr(clients, 'youtube'):
         # YouTube API setup
         api_key = os.getenv('YOUTUBE_API_KEY')
-        youtube = build('youtube', 'v3', developerKey=api_key)
-        
-        # Extract channel ID from URL
-        if 'channel/' in channel_url:
-            channel_id = channel_url.split('channel/')[1].split('/')[0]
-        elif '@' in channel_url:
-            # Handle new @username format
-            username = channel_url.split('@')[1].split('/')[0]
-            
-            print('this is the user name that we received', username)
-            
-            st.write('this is the user name that we received', username)
-            # Try legacy lookup using forUsername (may fail for custom handles)
-            request = youtube.channels().list(
-                part='id',
-                forHandle='@'+username
+        from googleapiclient.discovery import build
+        clients.youtube = build('youtube', 'v3', developerKey=api_key, cache_discovery=False)
+    return clients.youtube
+
+@st.cache_resource
+def get_youtube_enrich_executor():
+    # Process-wide, so the worker threads, and with them their thread-local
+    # clients, live across fetches instead of being rebuilt for every channel
+    return ThreadPoolExecutor(max_workers=YOUTUBE_ENRICH_CONCURRENCY, thread_name_prefix='youtube-enrich')
+
+@st.cache_resource
+def get_youtube_handle_cache():
+    return SQLiteCache(CACHE_DB_PATH, 'youtube_handles', max_entries=50000, default_ttl=YOUTUBE_HANDLE_TTL)
+
+def resolve_youtube_channel(youtube, ref):
+    # Channel ID for a parsed YouTube URL. Handles, usernames and custom URLs
+    # rarely move between channels, so the lookup is memoized by ref.key.
+    if ref.kind == 'channel_id':
+        return ref.identifier
+    cache = get_youtube_handle_cache()
+    cached = cache.get(ref.key)
+    if cached is not None:
+        return cached
+
+    if ref.kind == 'video':
+        request = youtube.videos().list(part='snippet', id=ref.identifier)
+        response = youtube_execute(request, 'videos.list')
+        if not response.get('items'):
+            raise Exception(f"Could not find video: {ref.identifier}")
+        channel_id = response['items'][0]['snippet']['channelId']
+        cache.set(ref.key, channel_id)
+        return channel_id
+
+    name = ref.identifier.lstrip('@')
+    # Legacy /user/ URLs resolve with forUsername; custom URLs usually match a handle
+    lookups = [('forHandle', '@' + name)]
+    if ref.kind == 'username':
+        lookups.insert(0, ('forUsername', name))
+    channel_id = None
+    for parameter, value in lookups:
+        request = youtube.channels().list(part='id', **{parameter: value})
+        response = youtube_execute(request, 'channels.list')
+        if response.get('items'):
+            channel_id = response['items'][0]['id']
+            break
+
+    if channel_id is None:
+        # Fallback: use search to resolve the custom handle to a channel ID
+        search_request = youtube.search().list(
+            part='snippet',
+            q=name,
+            type='channel',
+            maxResults=1
+        )
+        search_response = youtube_execute(search_request, 'search.list')
+        if search_response.get('items'):
+            channel_id = search_response['items'][0]['id']['channelId']
+        else:
+            raise Exception(f"Could not find channel for username: {name}")
+
+    cache.set(ref.key, channel_id)
+    return channel_id
+
+def list_videos(youtube, video_ids, part='snippet'):
+    # videos().list accepts up to 50 IDs per call; results keep the order of video_ids
+    videos = {}
+    for start in range(0, len(video_ids), 50):
+        request = youtube.videos().list(
+            part=part,
+            id=','.join(video_ids[start:start + 50]),
+            maxResults=50
+        )
+        response = youtube_execute(request, 'videos.list')
+        for video in response.get('items', []):
+            videos[video['id']] = video
+    return [videos[video_id] for video_id in video_ids if video_id in videos]
+
+def iter_upload_pages(youtube, uploads_playlist_id, limit=YOUTUBE_RECENT_VIDEOS):
+    # Yields pages (up to 50 items) of the uploads playlist, newest first, until
+    # limit items were seen; 1 quota unit per page (search costs 100)
+    from googleapiclient.errors import HttpError
+    page_token = None
+    remaining = limit
+    while remaining > 0:
+        try:
+            request = youtube.playlistItems().list(
+                part='contentDetails',
+                playlistId=uploads_playlist_id,
+                maxResults=min(remaining, 50),
+                pageToken=page_token
             )
-            response = request.execute()
+            response = youtube_execute(request, 'playlistItems.list')
+        except HttpError as e:
+            # Channels without any uploads have no uploads playlist
+            if e.resp.status == 404:
+                return
+            raise
+        items = response.get('items', [])[:remaining]
+        if not items:
+            return
+        yield items
+        remaining -= len(items)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+def fetch_recent_videos(uploads_playlist_id, limit, part='snippet,statistics,contentDetails'):
+    # Each playlist page is enriched with one videos().list call as soon as it
+    # arrives, so enrichment of earlier pages overlaps with paging. Workers use
+    # their own thread-local client and inherit the caller's request priority.
+    youtube = get_youtube_client()
+    executor = get_youtube_enrich_executor()
+    futures = [
+        executor.submit(
+            contextvars.copy_context().run,
+            lambda ids: list_videos(get_youtube_client(), ids, part),
+            [item['contentDetails']['videoId'] for item in page]
+        )
+        for page in iter_upload_pages(youtube, uploads_playlist_id, limit)
+    ]
+    return [video for future in futures for video in future.result()]
+
+def upload_ids_since(youtube, uploads_playlist_id, limit, newer_than):
+    # IDs of uploads published after newer_than (a publishedAt), newest first;
+    # paging stops at the first older upload
+    video_ids = []
+    for page in iter_upload_pages(youtube, uploads_playlist_id, limit):
+        for item in page:
+            published_at = item['contentDetails'].get('videoPublishedAt')
+            if published_at and published_at <= newer_than:
+                return video_ids
+            video_ids.append(item['contentDetails']['videoId'])
+    return video_ids
+
+def youtube_video_record(video):
+    from isodate import parse_duration
+    statistics = video.get('statistics', {})
+    views = int(statistics.get('viewCount', 0))
+    # Likes can be hidden by the creator; treat them as 0
+    likes = int(statistics.get('likeCount', 0))
+    comments = int(statistics.get('commentCount', 0))
+    duration_seconds = int(parse_duration(video['contentDetails']['duration']).total_seconds())
+    return {
+        'video_id': video['id'],
+        'title': video['snippet']['title'],
+        'description': video['snippet']['description'],
+        'published_at': video['snippet']['publishedAt'],
+        'views': views,
+        'likes': likes,
+        'comments': comments,
+        'duration_seconds': duration_seconds,
+        # Live streams and premieres report a zero duration
+        'is_short': 0 < duration_seconds < YOUTUBE_SHORTS_MAX_SECONDS,
+        'engagement_rate': round((likes + comments) / views * 100, 2) if views else 0.0,
+    }
+
+def summarize_youtube_videos(videos):
+    # Channel-level engagement, cadence and format mix over the enriched uploads
+    import numpy as np
+    if not videos:
+        return {'videos_analyzed': 0, 'shorts': 0, 'regular': 0, 'shorts_ratio': 0.0, 'avg_views': 0,
+                'median_views': 0, 'avg_engagement_rate': 0.0, 'weighted_engagement_rate': 0.0,
+                'uploads_per_week': 0.0, 'avg_duration_seconds': 0}
+    views = np.array([video['views'] for video in videos], dtype=float)
+    interactions = np.array([video['likes'] + video['comments'] for video in videos], dtype=float)
+    durations = np.array([video['duration_seconds'] for video in videos], dtype=float)
+    is_short = np.array([video['is_short'] for video in videos], dtype=bool)
+    published = np.array([
+        datetime.fromisoformat(video['published_at'].replace('Z', '+00:00')).timestamp() for video in videos
+    ])
+
+    watched = views > 0
+    per_video_rates = interactions[watched] / views[watched]
+    span_days = (published.max() - published.min()) / 86400
+    return {
+        'videos_analyzed': len(videos),
+        'shorts': int(is_short.sum()),
+        'regular': int((~is_short).sum()),
+        'shorts_ratio': round(float(is_short.mean()), 3),
+        'avg_views': int(views.mean()),
+        'median_views': int(np.median(views)),
+        'avg_engagement_rate': round(float(per_video_rates.mean()) * 100, 2) if per_video_rates.size else 0.0,
+        'weighted_engagement_rate': round(float(interactions.sum() / views.sum()) * 100, 2) if views.sum() else 0.0,
+        'uploads_per_week': round((len(videos) - 1) / span_days * 7, 2) if span_days > 0 else 0.0,
+        'avg_duration_seconds': int(durations.mean()),
+    }
+
+def get_youtube_info(channel_url):
+    profile_data = process_social_media_url(channel_url)
+    if not profile_data or profile_data['platform'] != 'youtube':
+        return "Error fetching YouTube channel: Invalid channel URL format"
+    return get_provider('youtube').fetch(profile_data)
+
+def fetch_youtube_channel(channel_url):
+    try:
+        youtube = get_youtube_client()
         
-            if response.get('items'):
-                channel_id = response['items'][0]['id']
-            else:
-                # Fallback: use search to resolve the custom handle to a channel ID
-                search_request = youtube.search().list(
-                    part='snippet',
-                    q=username,
-                    type='channel',
-                    maxResults=1
-                )
-                search_response = search_request.execute()
-                if search_response.get('items'):
-                    channel_id = search_response['items'][0]['id']['channelId']
-                else:
-                    raise Exception(f"Could not find channel for username: {username}")
-        else:
+        # Extract channel ID from URL
+        ref = parse_profile_url(channel_url)
+        if ref is None or ref.platform != 'youtube':
             raise Exception("Invalid channel URL format")
+        channel_id = resolve_youtube_channel(youtube, ref)
         
-        # Get channel statistics and snippet
+        # Get channel statistics, snippet and the uploads playlist
         channel_request = youtube.channels().list(
-            part='statistics,snippet',
+            part='statistics,snippet,contentDetails',
             id=channel_id
         )
-        channel_response = channel_request.execute()
+        channel_response = youtube_execute(channel_request, 'channels.list')
         channel_info = channel_response['items'][0]
+        uploads_playlist_id = channel_info['contentDetails']['relatedPlaylists']['uploads']
         
-        # Get recent videos from the channel
-        videos_request = youtube.search().list(
-            part='snippet',
-            channelId=channel_id,
-            order='date',
-            type='video',
-            maxResults=20
-        )
-        videos_response = videos_request.execute()
-        
-        # Extract video IDs from search results
-        # Get the latest 10 videos with their details
-        videos_data = []
-        for video in videos_response['items'][:10]:
-            if 'videoId' in video['id']:
-                video_data = {
-                    'title': video['snippet']['title'],
-                    'description': video['snippet']['description'],
-                    'published_at': video['snippet']['publishedAt']
-                }
-                videos_data.append(video_data)
+        # Enrich recent uploads with statistics and durations in 50-ID batches.
+        # With a snapshot, paging stops at the newest upload already seen, but
+        # the whole window is re-fetched in one videos().list, so older videos
+        # get current view, like and comment counts (deleted videos drop out)
+        profile_key = ProfileRef('youtube', 'channel_id', channel_id).key
+        snapshot = load_snapshot('profile', profile_key)
+        known_videos = snapshot['videos'] if snapshot else []
+        newer_than = known_videos[0]['published_at'] if known_videos else None
+        with span('youtube.enrich', refresh='delta' if newer_than else 'full'):
+            if newer_than:
+                new_ids = upload_ids_since(youtube, uploads_playlist_id, YOUTUBE_ENRICH_VIDEOS, newer_than)
+                window_ids = list(dict.fromkeys(new_ids + [video['video_id'] for video in known_videos]))
+                videos = list_videos(youtube, window_ids[:YOUTUBE_ENRICH_VIDEOS], 'snippet,statistics,contentDetails')
+            else:
+                videos = fetch_recent_videos(uploads_playlist_id, YOUTUBE_ENRICH_VIDEOS)
+            videos_data = [youtube_video_record(video) for video in videos]
+            engagement = summarize_youtube_videos(videos_data)
+        save_snapshot('profile', profile_key, {'videos': videos_data})
         
         return {
             'channel_name': channel_info['snippet']['title'],
@@ -156,79 +633,345 @@ def get_youtube_info(channel_url):
             'subscriber_count': int(channel_info['statistics']['subscriberCount']),
             'video_count': int(channel_info['statistics']['videoCount']),
             'view_count': int(channel_info['statistics']['viewCount']),
-            'recent_videos': videos_data
+            # Get the latest 10 videos with their details
+            'recent_videos': videos_data[:YOUTUBE_RECENT_VIDEOS],
+            'video_types': {'shorts': engagement['shorts'], 'regular': engagement['regular']},
+            'engagement': engagement,
+            'profile_key': profile_key
         }
     except Exception as e:
         return f"Error fetching YouTube channel: {str(e)}"
 
-def get_unsplash_images(query, count=3):
+@st.cache_resource
+def get_twitter_client():
+    import tweepy
+    return tweepy.Client(bearer_token=os.getenv('TWITTER_BEARER_TOKEN'))
+
+def twitter_tweet_record(tweet):
+    metrics = tweet.public_metrics or {}
+    return {
+        'text': tweet.text,
+        'created_at': tweet.created_at.isoformat() if tweet.created_at else None,
+        'likes': metrics.get('like_count', 0),
+        'replies': metrics.get('reply_count', 0),
+        'retweets': metrics.get('retweet_count', 0),
+        'quotes': metrics.get('quote_count', 0),
+    }
+
+def list_recent_tweets(user_id):
+    request = functools.partial(get_twitter_client().get_users_tweets, user_id,
+                                max_results=max(5, min(TWITTER_RECENT_TWEETS, 100)),
+                                exclude=['retweets', 'replies'], tweet_fields=['public_metrics', 'created_at'])
+    with span('twitter.users_tweets', detail=str(user_id)):
+        response = get_scheduler().call('twitter', request)
+    return [twitter_tweet_record(tweet) for tweet in response.data or []]
+
+def twitter_profile_record(user, tweets):
+    # Engagement rate: average likes, replies, retweets and quotes per tweet, as a share of followers
+    metrics = user.public_metrics or {}
+    followers = metrics.get('followers_count', 0)
+    interactions = sum(tweet['likes'] + tweet['replies'] + tweet['retweets'] + tweet['quotes']
+                       for tweet in tweets) / len(tweets) if tweets else 0
+    rate = round(interactions / followers * 100, 2) if followers else 0.0
+    return {
+        'username': user.username,
+        'name': user.name,
+        'description': user.description or '',
+        'followers': followers,
+        'following': metrics.get('following_count', 0),
+        'total_tweets': metrics.get('tweet_count', 0),
+        'tweets_analyzed': len(tweets),
+        'avg_engagement_rate': rate,
+        'avg_engagement': f"{rate}% per tweet ({round(interactions):,} interactions)" if tweets else 'Not enough recent tweets',
+        'recent_tweets': tweets[:10],
+        'profile_key': ProfileRef('twitter', 'username', user.username.lower()).key,
+    }
+
+def fetch_twitter_profiles(usernames):
+    # One users lookup for up to 100 usernames, then each user's recent tweets
+    # in parallel. Returns {username: profile_data or error string}.
+    results = {}
+    try:
+        request = functools.partial(get_twitter_client().get_users, usernames=usernames,
+                                    user_fields=['description', 'public_metrics'])
+        with span('twitter.users_lookup', detail=','.join(usernames)):
+            response = get_scheduler().call('twitter', request)
+    except Exception as e:
+        return {username: f"Error fetching Twitter profile: {str(e)}" for username in usernames}
+
+    users = {user.username.lower(): user for user in response.data or []}
+    with ThreadPoolExecutor(max_workers=TWITTER_CONCURRENCY) as executor:
+        tweets = {username: executor.submit(contextvars.copy_context().run, list_recent_tweets, user.id)
+                  for username, user in users.items()}
+        for username, user in users.items():
+            try:
+                results[username] = twitter_profile_record(user, tweets[username].result())
+            except Exception as e:
+                results[username] = f"Error fetching Twitter profile: {str(e)}"
+    for error in response.errors or []:
+        username = str(error.get('value', '')).lower()
+        if username in usernames:
+            results.setdefault(username, f"Error fetching Twitter profile: {error.get('detail', 'not found')}")
+    for username in usernames:
+        results.setdefault(username, f"Error fetching Twitter profile: could not find @{username}")
+    return results
+
+def tiktok_profile_record(username, user_info, videos):
+    # Engagement rate: likes, comments and shares per view over the recent videos
+    user, stats = user_info['user'], user_info['stats']
+    records = [{
+        'description': video.get('desc', ''),
+        'created_at': datetime.fromtimestamp(int(video.get('createTime', 0)), timezone.utc).isoformat(),
+        'views': video.get('stats', {}).get('playCount', 0),
+        'likes': video.get('stats', {}).get('diggCount', 0),
+        'comments': video.get('stats', {}).get('commentCount', 0),
+        'shares': video.get('stats', {}).get('shareCount', 0),
+    } for video in videos]
+    views = sum(record['views'] for record in records)
+    interactions = sum(record['likes'] + record['comments'] + record['shares'] for record in records)
+    rate = round(interactions / views * 100, 2) if views else 0.0
+    return {
+        'username': user.get('uniqueId', username),
+        'nickname': user.get('nickname', ''),
+        'bio': user.get('signature', ''),
+        'followers': stats.get('followerCount', 0),
+        'following': stats.get('followingCount', 0),
+        'total_likes': stats.get('heartCount', 0),
+        'video_count': stats.get('videoCount', 0),
+        'videos_analyzed': len(records),
+        'avg_views': round(views / len(records)) if records else 0,
+        'avg_engagement_rate': rate,
+        'avg_engagement': f"{rate}% of views ({len(records)} recent videos)" if records else 'Not calculated',
+        'recent_videos': records[:10],
+        'profile_key': ProfileRef('tiktok', 'username', username).key,
+    }
+
+async def fetch_tiktok_session(usernames):
+    # One browser session serves the whole batch; profiles are fetched in turn
+    # because parallel requests on one session trip TikTok's bot detection
+    from TikTokApi import TikTokApi
+    results = {}
+    async with TikTokApi() as api:
+        await api.create_sessions(ms_tokens=[os.getenv('TIKTOK_MS_TOKEN')], num_sessions=1, sleep_after=3)
+        for username in usernames:
+            try:
+                user = api.user(username)
+                user_info = (await user.info())['userInfo']
+                videos = [video.as_dict async for video in user.videos(count=TIKTOK_RECENT_VIDEOS)]
+                results[username] = tiktok_profile_record(username, user_info, videos)
+            except Exception as e:
+                results[username] = f"Error fetching TikTok profile: {str(e)}"
+    return results
+
+def fetch_tiktok_profiles(usernames):
+    try:
+        import TikTokApi  # noqa: F401
+    except ImportError:
+        return {username: "Error: TikTok profiles need the optional TikTokApi package" for username in usernames}
+    try:
+        # Charged as one scheduler call per session; runs in a worker thread, so
+        # it gets an event loop of its own
+        with span('tiktok.session', detail=','.join(usernames)):
+            return get_scheduler().call('tiktok', lambda: asyncio.run(fetch_tiktok_session(usernames)))
+    except Exception as e:
+        return {username: f"Error fetching TikTok profile: {str(e)}" for username in usernames}
+
+class InstagramProvider(ProfileProvider):
+    # One Actor run per batch of usernames
+    platform = 'instagram'
+    api = 'apify'
+    batch_size = INSTAGRAM_BATCH_SIZE
+
+    def fetch_batch(self, profiles):
+        infos = fetch_instagram_profiles([profile_data['username'] for profile_data in profiles], self.batch_size)
+        return {profile_data['key']: infos[profile_data['username']] for profile_data in profiles}
+
+class YouTubeProvider(ProfileProvider):
+    # channels.list, then playlistItems.list and videos.list per page of uploads
+    platform = 'youtube'
+    api = 'youtube'
+    calls_per_batch = 1 + 2 * -(-YOUTUBE_ENRICH_VIDEOS // 50)
+
+    def fetch_batch(self, profiles):
+        return {profile_data['key']: fetch_youtube_channel(profile_data['url']) for profile_data in profiles}
+
+    def cost(self, profiles):
+        # URLs without a channel ID need one more channels.list call to resolve
+        # (a search.list fallback, 100 units, is not included)
+        hint = super().cost(profiles)
+        resolves = sum(1 for profile_data in profiles if profile_data['kind'] != 'channel_id')
+        return CostHint(hint.api, hint.calls + resolves, hint.units + resolves * YOUTUBE_QUOTA_COSTS['channels.list'])
+
+class TwitterProvider(ProfileProvider):
+    # One users lookup per batch plus one timeline call per profile
+    platform = 'twitter'
+    api = 'twitter'
+    batch_size = TWITTER_BATCH_SIZE
+    calls_per_profile = 1
+
+    def fetch_batch(self, profiles):
+        infos = fetch_twitter_profiles([profile_data['username'] for profile_data in profiles])
+        return {profile_data['key']: infos[profile_data['username']] for profile_data in profiles}
+
+class TikTokProvider(ProfileProvider):
+    # One browser session per batch
+    platform = 'tiktok'
+    api = 'tiktok'
+    batch_size = TIKTOK_BATCH_SIZE
+
+    def fetch_batch(self, profiles):
+        infos = fetch_tiktok_profiles([profile_data['username'] for profile_data in profiles])
+        return {profile_data['key']: infos[profile_data['username']] for profile_data in profiles}
+
+@st.cache_resource
+def get_profile_providers():
+    # Every provider shares the profile cache and the single-flight group
+    providers = [provider_class(get_profile_cache(), get_profile_flight(), PROFILE_CACHE_TTLS[provider_class.platform])
+                 for provider_class in (InstagramProvider, YouTubeProvider, TwitterProvider, TikTokProvider)]
+    return {provider.platform: provider for provider in providers}
+
+def get_provider(platform):
+    return get_profile_providers().get(platform)
+
+def estimate_fetch_cost(urls):
+    # {api: {'profiles', 'calls', 'units'}} for fetching the URLs' profiles
+    # uncached; unsupported URLs are ignored
+    profiles = {}
+    for url in urls:
+        profile_data = process_social_media_url(url)
+        if profile_data:
+            profiles.setdefault(profile_data['platform'], {})[profile_data['key']] = profile_data
+    estimate = {}
+    for platform, by_key in profiles.items():
+        hint = get_provider(platform).cost(list(by_key.values()))
+        totals = estimate.setdefault(hint.api, {'profiles': 0, 'calls': 0, 'units': 0})
+        totals['profiles'] += len(by_key)
+        totals['calls'] += hint.calls
+        totals['units'] += hint.units
+    return estimate
+
+@st.cache_resource
+def get_unsplash_cache():
+    return SQLiteCache(CACHE_DB_PATH, 'unsplash_images', max_entries=UNSPLASH_CACHE_MAX_ENTRIES,
+                       default_ttl=UNSPLASH_CACHE_TTL)
+
+@st.cache_resource
+def get_unsplash_popularity():
+    # Most requested keyword sets in this process, for background prefetch
+    return TopK(capacity=200)
+
+def normalize_image_keywords(query):
+    # "Workspace, laptop,  productivity, laptop" -> "laptop productivity workspace"
+    terms = re.findall(r"[\w'-]+", query.lower())
+    return ' '.join(sorted(set(terms)))
+
+def fetch_unsplash_urls(keywords):
+    # One search per keyword set; photo URLs with fallback to the small size
+    with span('unsplash.search', detail=keywords):
+        photos = get_scheduler().call('unsplash', get_unsplash_api().photo.search, query=keywords,
+                                      per_page=UNSPLASH_PHOTOS_PER_SEARCH, timeout=UNSPLASH_WAIT_TIMEOUT)
+    urls = []
+    for photo in photos or []:
+        if hasattr(photo, 'urls'):
+            url = photo.urls.regular or photo.urls.small
+            if url:
+                urls.append(url)
+    return urls
+
+def search_unsplash_images(query, count=3):
+    # Returns (urls, level, message) without touching the Streamlit UI, so it is
+    # safe to call from worker threads; level is 'error'/'warning' when message is set
     try:
         # Initialize Unsplash client
         client_id = os.getenv('UNSPLASH_ACCESS_KEY')
         if not client_id:
-            st.error("Unsplash API key not found. Please check your environment variables.")
-            return []
+            return [], 'error', "Unsplash API key not found. Please check your environment variables."
 
-        auth = Auth(client_id)
-        api = Api(auth)
+        # Clean and prepare the query; equivalent keyword lists share a cache entry
+        keywords = normalize_image_keywords(query)
+        if not keywords:
+            return [], 'warning', "No search keywords provided for image search"
+        get_unsplash_popularity().add(keywords)
 
-        # Clean and prepare the query
-        query = query.strip()
-        if not query:
-            st.warning("No search keywords provided for image search")
-            return []
+        cache = get_unsplash_cache()
+        urls = cache.get(keywords)
+        if urls is None:
+            # Search for photos with error handling; errors are not cached
+            try:
+                urls = fetch_unsplash_urls(keywords)
+            except Exception as search_error:
+                return [], 'error', f"Error searching Unsplash photos: {str(search_error)}"
+            # Empty results are cached briefly so they do not burn the hourly limit
+            cache.set(keywords, urls, ttl=UNSPLASH_CACHE_TTL if urls else UNSPLASH_EMPTY_TTL)
 
-        # Search for photos with error handling
-        try:
-            photos = api.photo.search(query=query, per_page=count)
-            if not photos:
-                st.warning(f"No photos found for query: {query}")
-                return []
+        if not urls:
+            return [], 'warning', f"No photos found for query: {query.strip()}"
+        return urls[:count], None, None
+
+    except Exception as e:
+        return [], 'error', f"Error initializing Unsplash client: {str(e)}"
 
-            # Return photo URLs with fallback to small size if regular is not available
-            urls = []
-            for photo in photos:
-                if hasattr(photo, 'urls'):
-                    url = photo.urls.regular or photo.urls.small
-                    if url:
-                        urls.append(url)
+def prefetch_unsplash_images(keyword_sets, limit=UNSPLASH_PREFETCH_LIMIT):
+    # Warm the cache for keyword sets that are missing or expired, at batch
+    # priority: searches only use the Unsplash burst above the interactive
+    # reserve, so a cold-start round cannot leave interactive lookups waiting.
+    # Stops at the first failure (usually the reserve being reached). Returns
+    # the number of searches.
+    cache = get_unsplash_cache()
+    fetched = 0
+    with request_priority(PRIORITY_BATCH):
+        for keywords in dict.fromkeys(normalize_image_keywords(keyword_set) for keyword_set in keyword_sets):
+            if fetched >= limit:
+                break
+            if not keywords or keywords in cache:
+                continue
+            try:
+                urls = fetch_unsplash_urls(keywords)
+            except Exception:
+                break
+            cache.set(keywords, urls, ttl=UNSPLASH_CACHE_TTL if urls else UNSPLASH_EMPTY_TTL)
+            fetched += 1
+    return fetched
 
-            if not urls:
-                st.warning("Retrieved photos but no valid URLs found")
-                return []
+@st.cache_resource
+def start_unsplash_prefetch():
+    # Background thread that keeps configured and observed popular keyword sets cached
+    if not os.getenv('UNSPLASH_ACCESS_KEY') or UNSPLASH_PREFETCH_LIMIT <= 0:
+        return None
+    popularity = get_unsplash_popularity()
 
-            return urls
+    def run():
+        while True:
+            observed = [keywords for keywords, _ in popularity.most_common(UNSPLASH_PREFETCH_LIMIT)]
+            prefetch_unsplash_images(UNSPLASH_POPULAR_KEYWORDS + observed)
+            time.sleep(UNSPLASH_PREFETCH_INTERVAL)
 
-        except Exception as search_error:
-            st.error(f"Error searching Unsplash photos: {str(search_error)}")
-            return []
+    thread = threading.Thread(target=run, name='unsplash-prefetch', daemon=True)
+    thread.start()
+    return thread
 
-    except Exception as e:
-        st.error(f"Error initializing Unsplash client: {str(e)}")
-        return []
+def get_unsplash_images(query, count=3):
+    urls, level, message = search_unsplash_images(query, count)
+    if message:
+        getattr(st, level)(message)
+    return urls
 
 
 def process_social_media_url(url):
-    if 'instagram.com' in url:
-        return {'platform': 'instagram', 'username': url.split('instagram.com/')[1].split('/')[0]}
-    elif 'youtube.com' in url:
-        return {'platform': 'youtube', 'url': url}
-    elif 'twitter.com' in url or 'x.com' in url:
-        return {'platform': 'twitter', 'username': url.split('/')[-1]}
-    elif 'tiktok.com' in url:
-        return {'platform': 'tiktok', 'username': url.split('/@')[-1].split('?')[0]}
-    return None
+    # Route a profile URL to its platform; anything that is not a recognizable
+    # profile is rejected here, before it costs an API call. 'key' is the
+    # canonical profile key and 'url' the canonical profile URL.
+    ref = parse_profile_url(url)
+    if ref is None:
+        return None
+    profile_data = {'platform': ref.platform, 'kind': ref.kind, 'key': ref.key, 'url': ref.url}
+    if ref.kind == 'username' and ref.platform != 'youtube':
+        profile_data['username'] = ref.identifier
+    return profile_data
 
-def get_product_recommendations(profile_info, openai_api_key, platform='instagram'):
-    try:
-        if not openai_api_key:
-            return "Please provide an OpenAI API key to get product recommendations."
-        
-        llm = ChatOpenAI(openai_api_key=openai_api_key, temperature=0.7, model_name="gpt-3.5-turbo")
-        
-        # Platform-specific templates
-        templates = {
-            'instagram': """Based on the following Instagram profile information, analyze and suggest 5 digital products that would be most suitable for this creator to sell to their audience. For each product:
+# Platform-specific recommendation templates
+RECOMMENDATION_TEMPLATES = {
+    'instagram': """Based on the following Instagram profile information, analyze and suggest 5 digital products that would be most suitable for this creator to sell to their audience. For each product:
 1. Specify the product category (e.g., Course, Ebook, Template, Membership, Software Tool)
 2. Provide a specific product recommendation
 3. Explain why it would work well for this audience
@@ -245,8 +988,8 @@ Product 1:
 - Image Keywords: [3-4 keywords for visuals]
 
 [Repeat for all 5 products]""",
-            
-            'youtube': """Based on the following YouTube channel information, analyze and suggest 5 digital products that would be most suitable for this creator to sell to their audience. For each product:
+    
+    'youtube': """Based on the following YouTube channel information, analyze and suggest 5 digital products that would be most suitable for this creator to sell to their audience. For each product:
 1. Specify the product category (e.g., Course, Ebook, Template, Membership, Software Tool)
 2. Provide a specific product recommendation
 3. Explain why it would work well for this audience
@@ -262,144 +1005,1243 @@ Product 1:
 - Reasoning: [explanation]
 - Image Keywords: [3-4 keywords for visuals]
 
+[Repeat for all 5 products]""",
+
+    'combined': """Based on the following information about one creator's presence across several social media platforms, analyze their combined audience and suggest 5 digital products that would be most suitable for this creator to sell. Prefer products that can be promoted on all of their platforms. For each product:
+1. Specify the product category (e.g., Course, Ebook, Template, Membership, Software Tool)
+2. Provide a specific product recommendation
+3. Explain why it would work well for this audience
+4. Suggest relevant keywords for finding product imagery
+
+Creator Information:
+{profile_info}
+
+Format each recommendation as:
+Product 1:
+- Category: [category]
+- Product: [specific product name/description]
+- Reasoning: [explanation]
+- Image Keywords: [3-4 keywords for visuals]
+
 [Repeat for all 5 products]"""
-        }
-        
-        prompt = PromptTemplate(
-            input_variables=["profile_info"],
-            template=templates.get(platform, templates['instagram'])
-        )
-        
-        chain = LLMChain(llm=llm, prompt=prompt)
-        
-        # Format profile info based on platform
-        if platform == 'instagram':
-            profile_summary = f"""- Audience size: {profile_info['followers']} followers
-- Content focus: Top hashtags include {', '.join(list(profile_info['top_hashtags'].keys())[:5])}
-- Engagement rate: {profile_info['avg_engagement_rate']}%
-- Content mix: {profile_info['post_types']['image']} images, {profile_info['post_types']['video']} videos
-- Bio: {profile_info['bio']}"""
-        
-        elif platform == 'youtube':
-            profile_summary = f"""- Channel name: {profile_info['channel_name']}
+}
+
+# Replaces the free-text format section of a template in JSON output mode
+RECOMMENDATION_JSON_FORMAT = """Respond with a JSON object that follows this schema:
+{{"products": [{{"category": "category", "product": "specific product name/description", "reasoning": "explanation", "image_keywords": "3-4 keywords for visuals"}}]}}
+
+The "products" array must contain exactly 5 products."""
+
+def recommendation_template(platform='instagram'):
+    template = RECOMMENDATION_TEMPLATES.get(platform, RECOMMENDATION_TEMPLATES['instagram'])
+    if RECOMMENDATION_OUTPUT_MODE == 'json':
+        template = template[:template.index('Format each recommendation as:')] + RECOMMENDATION_JSON_FORMAT
+    return template
+
+def build_recommendation_prompt(platform='instagram'):
+    from langchain.prompts import PromptTemplate
+    return PromptTemplate(
+        input_variables=["profile_info"],
+        template=recommendation_template(platform)
+    )
+
+def compact_field(text, max_tokens):
+    # Free text on one line, without links, cut to max_tokens
+    return truncate_tokens(' / '.join(clean_text(text).splitlines()), max_tokens, LLM_MODEL)
+
+def build_profile_summary(profile_info, platform='instagram', field_tokens=PROMPT_FIELD_TOKENS,
+                          video_descriptions=PROMPT_VIDEO_DESCRIPTIONS):
+    # Format profile info based on platform
+    if platform == 'instagram':
+        post_types = profile_info.get('post_types', {})
+        profile_summary = f"""- Audience size: {profile_info['followersCount']} followers
+- Content focus: Top hashtags include {', '.join(list(profile_info.get('top_hashtags', {}).keys())[:5])}
+- Engagement rate: {profile_info.get('avg_engagement_rate', 0)}%
+- Content mix: {post_types.get('image', 0)} images, {post_types.get('video', 0)} videos, {post_types.get('carousel', 0)} carousels
+- Bio: {compact_field(profile_info['biography'], field_tokens)}"""
+    
+    elif platform == 'youtube':
+        profile_summary = f"""- Channel name: {profile_info['channel_name']}
 - Subscriber count: {profile_info['subscriber_count']:,}
 - Total views: {profile_info['view_count']:,}
-- Channel description: {profile_info['description']}"""
-        
-        elif platform == 'twitter':
-            profile_summary = f"""- Followers: {profile_info['followers']:,}
+- Channel description: {compact_field(profile_info['description'], field_tokens)}"""
+        engagement = profile_info.get('engagement')
+        if engagement and engagement['videos_analyzed']:
+            profile_summary += f"""
+- Recent uploads analyzed: {engagement['videos_analyzed']} ({engagement['shorts_ratio']:.0%} Shorts)
+- Upload cadence: {engagement['uploads_per_week']} videos per week
+- Median views per video: {engagement['median_views']:,}
+- Average engagement rate: {engagement['avg_engagement_rate']}% (likes and comments per view)
+- Recent video titles: {'; '.join(video['title'] for video in profile_info['recent_videos'])}"""
+        # Lines repeated across descriptions (links, sign-offs, sponsor blurbs)
+        # or copied from the channel description are kept only once
+        videos = profile_info.get('recent_videos', [])[:video_descriptions]
+        descriptions = dedupe_lines([video.get('description', '') for video in videos],
+                                    seen=[profile_info['description']])
+        descriptions = [(video['title'], compact_field(description, field_tokens // 2))
+                        for video, description in zip(videos, descriptions) if description]
+        if descriptions:
+            profile_summary += '\n- Recent video descriptions:' + ''.join(
+                f'\n  - {title}: {description}' for title, description in descriptions)
+    
+    elif platform == 'twitter':
+        profile_summary = f"""- Followers: {profile_info['followers']:,}
 - Average engagement: {profile_info['avg_engagement']}
 - Total tweets: {profile_info['total_tweets']:,}
-- Profile description: {profile_info['description']}"""
-        
-        elif platform == 'tiktok':
-            profile_summary = f"""- Followers: {profile_info['followers']:,}
+- Profile description: {compact_field(profile_info['description'], field_tokens)}"""
+    
+    elif platform == 'tiktok':
+        profile_summary = f"""- Followers: {profile_info['followers']:,}
 - Total likes: {profile_info['total_likes']:,}
 - Video count: {profile_info['video_count']:,}
 - Average engagement: {profile_info['avg_engagement']}"""
+        if profile_info.get('bio'):
+            profile_summary += f"\n- Bio: {compact_field(profile_info['bio'], field_tokens)}"
+
+    elif platform == 'combined':
+        audience = ', '.join(f"{PLATFORM_NAMES[name]} ({size:,}, {profile_info['audience_share'][name]:.0%})"
+                             for name, size in profile_info['audience'].items())
+        engagement = ', '.join(f"{PLATFORM_NAMES[name]} {rate}%"
+                               for name, rate in profile_info['engagement_rates'].items() if rate is not None)
+        profile_summary = f"""- Total audience: {profile_info['total_audience']:,} across {audience}
+- Engagement rate by platform: {engagement or 'unknown'}"""
+        for name, info in profile_info['platforms'].items():
+            profile_summary += f"\n\n{PLATFORM_NAMES[name]}:\n" + build_profile_summary(
+                info, name, field_tokens, video_descriptions)
+    return profile_summary
+
+def fit_profile_summary(profile_info, platform='instagram'):
+    # Profile summary compacted until the filled-in prompt fits PROMPT_TOKEN_BUDGET:
+    # video descriptions are dropped one by one, then the free-text caps halved,
+    # and as a last resort the summary itself is cut
+    available = PROMPT_TOKEN_BUDGET - count_tokens(recommendation_template(platform).format(profile_info=''), LLM_MODEL)
+    field_tokens, video_descriptions = PROMPT_FIELD_TOKENS, PROMPT_VIDEO_DESCRIPTIONS
+    while True:
+        profile_summary = build_profile_summary(profile_info, platform, field_tokens, video_descriptions)
+        if count_tokens(profile_summary, LLM_MODEL) <= available:
+            break
+        if video_descriptions:
+            video_descriptions -= 1
+        elif field_tokens > PROMPT_MIN_FIELD_TOKENS:
+            field_tokens //= 2
+        else:
+            profile_summary = truncate_tokens(profile_summary, available, LLM_MODEL)
+            break
+    if (field_tokens, video_descriptions) != (PROMPT_FIELD_TOKENS, PROMPT_VIDEO_DESCRIPTIONS):
+        REGISTRY.inc('prompt_compactions_total', platform=platform)
+    return profile_summary
+
+PLATFORM_NAMES = {'instagram': 'Instagram', 'youtube': 'YouTube', 'twitter': 'Twitter/X', 'tiktok': 'TikTok'}
+
+def audience_size(info, platform):
+    if platform == 'instagram':
+        return info.get('followersCount') or 0
+    if platform == 'youtube':
+        return info.get('subscriber_count') or 0
+    return info.get('followers') or 0
+
+def engagement_rate(info, platform):
+    if platform == 'youtube':
+        return (info.get('engagement') or {}).get('avg_engagement_rate')
+    return info.get('avg_engagement_rate')
+
+def merge_creator_profiles(infos):
+    # One audience profile for a creator from {platform: profile_info}
+    audience = {platform: audience_size(info, platform) for platform, info in infos.items()}
+    total_audience = sum(audience.values())
+    return {
+        'platforms': infos,
+        'audience': audience,
+        'total_audience': total_audience,
+        'audience_share': {platform: size / total_audience if total_audience else 0.0
+                           for platform, size in audience.items()},
+        'engagement_rates': {platform: engagement_rate(info, platform) for platform, info in infos.items()},
+        'profile_key': 'creator:' + '+'.join(sorted(info.get('profile_key', platform) for platform, info in infos.items())),
+    }
+
+@st.cache_resource
+def get_llm(openai_api_key, streaming=False):
+    from langchain.chat_models import ChatOpenAI
+    # Retries are handled by the scheduler
+    model_kwargs = {'response_format': {'type': 'json_object'}} if RECOMMENDATION_OUTPUT_MODE == 'json' else {}
+    return ChatOpenAI(openai_api_key=openai_api_key, temperature=LLM_TEMPERATURE, model_name=LLM_MODEL,
+                      streaming=streaming, max_retries=0, model_kwargs=model_kwargs)
+
+@st.cache_resource
+def get_recommendation_cache():
+    return SQLiteCache(CACHE_DB_PATH, 'recommendations', max_entries=RECOMMENDATION_CACHE_MAX_ENTRIES,
+                       default_ttl=RECOMMENDATION_CACHE_TTL)
+
+@st.cache_resource
+def get_recommendation_flight():
+    # Concurrent requests with the same cache key share one LLM generation
+    return SingleFlight('recommendations')
+
+def round_significant(value, digits=2):
+    # 123456 -> 120000, 3.47 -> 3.5
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value == 0:
+        return value
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+def normalized_profile_summary(profile_info, platform='instagram'):
+    # Profile summary with counts rounded and hashtags sorted, so near-identical
+    # profiles (a few new followers, reordered hashtags) share a cache entry
+    if platform == 'combined':
+        return ' | '.join(normalized_profile_summary(info, name) for name, info in sorted(profile_info['platforms'].items()))
+    normalized = {}
+    for key, value in profile_info.items():
+        if isinstance(value, dict) and key == 'top_hashtags':
+            value = dict.fromkeys(sorted(list(value)[:5]), 0)
+        elif isinstance(value, dict):
+            value = {k: round_significant(v) for k, v in value.items()}
+        normalized[key] = round_significant(value)
+    return ' '.join(build_profile_summary(normalized, platform).lower().split())
+
+def recommendation_cache_key(profile_info, platform, profile_summary):
+    # Content address of everything that determines the LLM output
+    if RECOMMENDATION_CACHE_MODE == 'semantic':
+        profile_summary = normalized_profile_summary(profile_info, platform)
+    template = recommendation_template(platform)
+    payload = json.dumps([LLM_MODEL, LLM_TEMPERATURE, template, profile_summary])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def recommendation_config_key(platform):
+    return hashlib.sha256(json.dumps([LLM_MODEL, LLM_TEMPERATURE, recommendation_template(platform)]).encode('utf-8')).hexdigest()
+
+def summary_change(old_summary, new_summary):
+    # Fraction of the summary's words that changed (0 = identical, 1 = disjoint)
+    return 1 - difflib.SequenceMatcher(None, old_summary.split(), new_summary.split(), autojunk=False).ratio()
+
+def reusable_recommendations(profile_info, platform):
+    # Recommendations stored for an earlier snapshot of this profile, if its
+    # summary has drifted less than RECOMMENDATION_REFRESH_THRESHOLD since they
+    # were generated (the baseline only moves when they are regenerated)
+    profile_key = profile_info.get('profile_key')
+    if not profile_key or RECOMMENDATION_REFRESH_THRESHOLD <= 0:
+        return None
+    snapshot = load_snapshot('recommendation', profile_key)
+    if not snapshot or snapshot['config'] != recommendation_config_key(platform):
+        return None
+    change = summary_change(snapshot['summary'], normalized_profile_summary(profile_info, platform))
+    if change >= RECOMMENDATION_REFRESH_THRESHOLD:
+        return None
+    REGISTRY.inc('recommendations_reused_total', platform=platform)
+    return snapshot['recommendations']
+
+def save_recommendations(profile_info, platform, recommendations):
+    if profile_info.get('profile_key'):
+        save_snapshot('recommendation', profile_info['profile_key'], {
+            'config': recommendation_config_key(platform),
+            'summary': normalized_profile_summary(profile_info, platform),
+            'recommendations': recommendations,
+        })
+
+def get_product_recommendations(profile_info, openai_api_key, platform='instagram'):
+    try:
+        if not openai_api_key:
+            return "Please provide an OpenAI API key to get product recommendations."
         
-        recommendations = chain.run(profile_summary)
-        return recommendations
+        profile_summary = fit_profile_summary(profile_info, platform)
+        cache = get_recommendation_cache()
+        cache_key = recommendation_cache_key(profile_info, platform, profile_summary)
+        cached = cache.get(cache_key)
+        if cached is None:
+            cached = reusable_recommendations(profile_info, platform)
+            if cached is not None:
+                cache.set(cache_key, cached)
+        if cached is not None:
+            return cached
+
+        def generate():
+            if cache_key in cache:
+                return cache.get(cache_key)
+            from langchain.chains import LLMChain
+            chain = LLMChain(llm=get_llm(openai_api_key), prompt=build_recommendation_prompt(platform))
+            with span('openai.generate', platform=platform):
+                recommendations = get_scheduler().call('openai', chain.run, profile_summary)
+            record_token_usage(platform, recommendation_template(platform).format(profile_info=profile_summary),
+                               recommendations)
+            cache.set(cache_key, recommendations)
+            save_recommendations(profile_info, platform, recommendations)
+            return recommendations
+
+        return get_recommendation_flight().do(cache_key, generate)
     except Exception as e:
         return f"Error generating recommendations: {str(e)}"
 
-# Streamlit UI
-st.title('Social Media Profile Analyzer & Product Recommender')
+class RecommendationError(Exception):
+    pass
 
-# Get OpenAI API key from environment variables
-openai_api_key = os.getenv('OPENAI_API_KEY')
-if not openai_api_key:
-    st.error('OpenAI API key not found in environment variables. Please add OPENAI_API_KEY to your .env file.')
-    st.stop()
+def stream_product_recommendations(profile_info, openai_api_key, platform='instagram'):
+    # Same as get_product_recommendations, but yields the text as tokens arrive.
+    # Failures are raised as RecommendationError instead of being yielded as
+    # text, so callers can tell them apart from a generation.
+    try:
+        if not openai_api_key:
+            raise RecommendationError("Please provide an OpenAI API key to get product recommendations.")
 
-# Social media platform selection
-platform = st.selectbox('Select Platform:', ['Instagram', 'YouTube'])
+        prompt = build_recommendation_prompt(platform)
+        profile_summary = fit_profile_summary(profile_info, platform)
+        cache = get_recommendation_cache()
+        cache_key = recommendation_cache_key(profile_info, platform, profile_summary)
+        cached = cache.get(cache_key)
+        if cached is None:
+            cached = reusable_recommendations(profile_info, platform)
+            if cached is not None:
+                cache.set(cache_key, cached)
+        if cached is not None:
+            yield cached
+            return
 
-# URL input
-profile_url = st.text_input(f'Enter the {platform} profile URL:')
+        # While another session streams the same generation, wait for its full
+        # text (or error) instead of starting a second one
+        flight_group = get_recommendation_flight()
+        flight, leader = flight_group.join(cache_key)
+        if not leader:
+            yield flight.wait()
+            return
+        try:
+            # A flight that finished just before this one joined has filled the cache
+            if cache_key in cache:
+                recommendations = cache.get(cache_key)
+                yield recommendations
+            else:
+                prompt_text = prompt.format(profile_info=profile_summary)
+                recommendations = yield from stream_generation(prompt_text, openai_api_key, platform)
+                if recommendations:
+                    record_token_usage(platform, prompt_text, recommendations)
+        except Exception as e:
+            flight_group.finish(cache_key, flight, error=e)
+            raise
+        except BaseException:
+            # The consumer stopped reading; waiters must not hang on this flight
+            flight_group.finish(cache_key, flight, error=RuntimeError('Generation was cancelled'))
+            raise
+        flight_group.finish(cache_key, flight, value=recommendations)
+        # Only complete generations are cached
+        if recommendations:
+            cache.set(cache_key, recommendations)
+            save_recommendations(profile_info, platform, recommendations)
+    except RecommendationError:
+        raise
+    except Exception as e:
+        raise RecommendationError(f"Error generating recommendations: {str(e)}") from e
 
-if st.button('Analyze Profile') and profile_url:
-    profile_data = process_social_media_url(profile_url)
-    
-    if profile_data:
-        with st.spinner('Fetching profile information...'):
-            if profile_data['platform'] == 'instagram':
-                info = get_instagram_info(profile_data['username'])
-                if isinstance(info, dict):
-                    st.subheader('Profile Information')
-                    st.write(f"Username: {info['username']}")
-                    st.write(f"Bio: {info['biography']}")
-                    st.write(f"Followers: {info['followersCount']:,}")
-                    st.write(f"Following: {info['followsCount']:,}")
-                    st.write(f"Total Posts: {info['postsCount']:,}")
+@st.cache_resource
+def get_token_usage_log():
+    return deque(maxlen=TOKEN_USAGE_LOG_SIZE)
+
+def record_token_usage(platform, prompt_text, completion):
+    # Token counts of one LLM request (counted locally, so chat message overhead
+    # is not included), exported as metrics and kept for the sidebar
+    usage = {
+        'platform': platform,
+        'prompt_tokens': count_tokens(prompt_text, LLM_MODEL),
+        'completion_tokens': count_tokens(completion, LLM_MODEL),
+        'budget': PROMPT_TOKEN_BUDGET,
+        'at': datetime.now().strftime('%H:%M:%S'),
+    }
+    REGISTRY.inc('llm_tokens_total', usage['prompt_tokens'], kind='prompt', platform=platform)
+    REGISTRY.inc('llm_tokens_total', usage['completion_tokens'], kind='completion', platform=platform)
+    get_token_usage_log().append(usage)
+    return usage
+
+def stream_generation(prompt_text, openai_api_key, platform):
+    # Yields the chunks of one streamed LLM generation and returns the full text
+    llm = get_llm(openai_api_key, streaming=True)
+
+    def start_stream():
+        # Connection and rate-limit errors surface on the first chunk, so only
+        # that part is retried; a stream is never restarted mid-way
+        stream = llm.stream(prompt_text)
+        return next(stream, None), stream
+
+    with span('openai.first_token', platform=platform):
+        first, stream = get_scheduler().call('openai', start_stream)
+    if first is None:
+        return ''
+    recommendations = ''
+    with span('openai.stream', platform=platform):
+        for chunk in itertools.chain([first], stream):
+            if chunk.content:
+                recommendations += chunk.content
+                yield chunk.content
+    return recommendations
+
+@dataclasses.dataclass
+class ProductRecommendation:
+    __slots__ = ('number', 'category', 'product', 'reasoning', 'image_keywords')
+    number: int
+    category: str
+    product: str
+    reasoning: str
+    image_keywords: str
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+# Tolerates markdown decoration ("**Product 1:**", "### Product 1") and missing
+# brackets around field values, which the LLM often drops
+PRODUCT_HEADER_PATTERN = re.compile(r'^[ \t#*]*Product[ \t]+(\d+)[ \t]*[:.)]?\**', re.MULTILINE)
+PRODUCT_FIELD_PATTERN = re.compile(
+    r'^[ \t]*(?:[-*\u2022][ \t]*)?\**(Category|Product|Reasoning|Image Keywords)\**[ \t]*:\**[ \t]*'
+    r'\[?([^\n]*?)\]?[ \t]*$',
+    re.MULTILINE | re.IGNORECASE
+)
+IMAGE_KEYWORDS_LINE_PATTERN = re.compile(r'Image Keywords\**[ \t]*:[^\n]*\n', re.IGNORECASE)
+
+def product_record(number, fields):
+    # Returns a ProductRecommendation, or None when the category or image keywords are missing
+    keywords = fields.get('image_keywords') or ''
+    if isinstance(keywords, list):
+        keywords = ', '.join(str(keyword) for keyword in keywords)
+    category = str(fields.get('category') or '').strip()
+    keywords = keywords.strip()
+    if not (category and keywords):
+        return None
+    return ProductRecommendation(
+        number=int(number),
+        category=category,
+        product=str(fields.get('product') or '').strip(),
+        reasoning=str(fields.get('reasoning') or '').strip(),
+        image_keywords=keywords,
+    )
+
+def parse_product_block(block):
+    # Single pass over the field lines of one "Product N:" block
+    header_match = PRODUCT_HEADER_PATTERN.match(block)
+    if not header_match:
+        return None
+    fields = {}
+    for field_match in PRODUCT_FIELD_PATTERN.finditer(block, header_match.end()):
+        fields.setdefault(field_match.group(1).lower().replace(' ', '_'), field_match.group(2))
+    return product_record(header_match.group(1), fields)
+
+def parse_product_json(text):
+    # JSON output mode: {"products": [{...}, ...]}; raises ValueError on malformed JSON
+    data = json.loads(text)
+    products = data.get('products', []) if isinstance(data, dict) else data
+    if not isinstance(products, list):
+        raise ValueError('Expected a list of products')
+    records = []
+    for index, product in enumerate(products, start=1):
+        if isinstance(product, dict):
+            record = product_record(index, product)
+            if record:
+                records.append(record)
+    return records
+
+class ProductStreamParser:
+    # Incrementally splits streamed recommendation text into "Product N:" blocks.
+    # A block is emitted as soon as its Image Keywords line is complete, or when
+    # the next header (or the end of the stream) closes it.
+
+    def __init__(self):
+        self._buffer = ''
+
+    def _is_json(self):
+        return self._buffer.lstrip().startswith(('{', '['))
+
+    def feed(self, text):
+        self._buffer += text
+        records = []
+        # JSON output is only parseable once complete
+        if self._is_json():
+            return records
+        while True:
+            header = PRODUCT_HEADER_PATTERN.search(self._buffer)
+            if not header:
+                break
+            next_header = PRODUCT_HEADER_PATTERN.search(self._buffer, header.end())
+            if next_header:
+                block = self._buffer[header.start():next_header.start()]
+                self._buffer = self._buffer[next_header.start():]
+            else:
+                keywords_line = IMAGE_KEYWORDS_LINE_PATTERN.search(self._buffer, header.end())
+                if not keywords_line:
+                    break
+                block = self._buffer[header.start():keywords_line.end()]
+                self._buffer = self._buffer[keywords_line.end():]
+            record = parse_product_block(block)
+            if record:
+                records.append(record)
+        return records
+
+    def close(self):
+        if self._is_json():
+            text, self._buffer = self._buffer, ''
+            try:
+                return parse_product_json(text)
+            except ValueError:
+                # Fall back to the free-text format
+                self._buffer = text
+        header = PRODUCT_HEADER_PATTERN.search(self._buffer)
+        block = self._buffer[header.start():] if header else ''
+        self._buffer = ''
+        record = parse_product_block(block) if block else None
+        return [record] if record else []
+
+def parse_product_recommendations(recommendations):
+    with span('recommendations.parse'):
+        parser = ProductStreamParser()
+        return parser.feed(recommendations) + parser.close()
+
+@traced('render.product')
+def render_product(record):
+    # Create a column layout for the product; returns the placeholder for its image
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        st.write(f"Product {record.number}: {record.category}")
+        if RECOMMENDATION_OUTPUT_MODE == 'json':
+            st.write(record.product)
+            st.caption(record.reasoning)
+    with col2:
+        image_placeholder = st.empty()
+    st.markdown("---")
+    return image_placeholder
+
+@traced('render.product_image')
+def render_product_image(image_placeholder, record, result):
+    images, level, message = result
+    with image_placeholder.container():
+        if message:
+            getattr(st, level)(message)
+        if images:
+            st.image(images[0], caption=f"Visualization for {record.category}", use_column_width=True)
+        else:
+            st.warning(f"No visualization available for {record.category}")
+
+# Display Unsplash images for each product recommendation
+def display_product_images(recommendations):
+    st.subheader('Product Visualizations')
+    # Dispatch every image lookup up front, then render in the original order
+    with ThreadPoolExecutor(max_workers=UNSPLASH_MAX_CONCURRENCY) as executor:
+        records = parse_product_recommendations(recommendations)
+        futures = [executor.submit(search_unsplash_images, record.image_keywords, 1) for record in records]
+        for record, future in zip(records, futures):
+            render_product_image(render_product(record), record, future.result())
+
+# Batch analysis settings
+BATCH_OUTPUT_DIR = os.getenv('BATCH_OUTPUT_DIR', '.cache/batches')
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 16))
+BATCH_CONCURRENCY = {
+    'instagram': int(os.getenv('BATCH_INSTAGRAM_CONCURRENCY', 4)),
+    'youtube': int(os.getenv('BATCH_YOUTUBE_CONCURRENCY', 8)),
+    'twitter': int(os.getenv('BATCH_TWITTER_CONCURRENCY', 2)),
+    'tiktok': int(os.getenv('BATCH_TIKTOK_CONCURRENCY', 1)),
+    'openai': int(os.getenv('BATCH_OPENAI_CONCURRENCY', 8)),
+}
+BATCH_CSV_FIELDS = ['url', 'platform', 'error', 'profile', 'recommendations', 'products']
+
+def fetch_profile_info(profile_data):
+    provider = get_provider(profile_data['platform'])
+    if provider is None:
+        return f"Error: {profile_data['platform']} profiles are not supported yet"
+    return provider.fetch(profile_data)
+
+async def afetch_profile_info(profile_data):
+    provider = get_provider(profile_data['platform'])
+    if provider is None:
+        return f"Error: {profile_data['platform']} profiles are not supported yet"
+    return await provider.afetch(profile_data)
+
+def read_batch_urls(lines, filename=''):
+    # Accepts CSV (a 'url' column, or the first column), JSONL ({"url": ...}) or one URL per line
+    lines = [line for line in lines if line.strip()]
+    if filename.endswith('.jsonl'):
+        urls = [json.loads(line).get('url', '') for line in lines]
+    elif filename.endswith('.csv'):
+        rows = list(csv.reader(lines))
+        if rows and 'url' in [column.strip().lower() for column in rows[0]]:
+            column = [column.strip().lower() for column in rows[0]].index('url')
+            rows = rows[1:]
+        else:
+            column = 0
+        urls = [row[column] for row in rows if len(row) > column]
+    else:
+        urls = lines
+    # Preserve order, drop blanks and duplicates (different spellings of one
+    # profile count as duplicates)
+    unique = {}
+    for url in (url.strip() for url in urls if url.strip()):
+        unique.setdefault((process_social_media_url(url) or {}).get('key', url), url)
+    return list(unique.values())
+
+def load_batch_checkpoint(output_path):
+    # URLs already analyzed successfully in a previous run of the same batch
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, newline='', encoding='utf-8') as f:
+        if output_path.endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        return {row['url'] for row in rows if not row.get('error')}
+
+def analyze_profile_url(url, openai_api_key, semaphores, info=None):
+    # info may be passed in when the profile was already fetched in bulk
+    result = {'url': url, 'platform': None, 'error': None, 'profile': None, 'recommendations': None, 'products': []}
+    profile_data = process_social_media_url(url)
+    if not profile_data:
+        result['error'] = 'Unsupported profile URL'
+        return result
+    result['platform'] = profile_data['platform']
+
+    if info is None:
+        with semaphores.get(profile_data['platform'], semaphores['default']), request_priority(PRIORITY_BATCH):
+            info = fetch_profile_info(profile_data)
+    if not isinstance(info, dict):
+        result['error'] = info
+        return result
+    result['profile'] = info
+
+    with semaphores['openai'], request_priority(PRIORITY_BATCH):
+        recommendations = get_product_recommendations(info, openai_api_key, profile_data['platform'])
+    result['recommendations'] = recommendations
+    if recommendations.startswith('Error generating recommendations'):
+        result['error'] = recommendations
+    else:
+        result['products'] = [record.to_dict() for record in parse_product_recommendations(recommendations)]
+    return result
+
+def prefetch_profiles(platform, urls, semaphores):
+    # One bulk provider fetch for a batch of same-platform URLs; returns [(url, info)]
+    profiles = {url: process_social_media_url(url) for url in urls}
+    with semaphores.get(platform, semaphores['default']), request_priority(PRIORITY_BATCH):
+        infos = get_provider(platform).fetch_many(list(profiles.values()))
+    return [(url, infos[profile_data['key']]) for url, profile_data in profiles.items()]
+
+def run_batch(urls, output_path, openai_api_key, max_workers=BATCH_MAX_WORKERS):
+    # Analyze URLs concurrently (bounded per platform) and append each result to
+    # output_path (JSONL, or CSV by extension) as soon as it completes.
+    # URLs already present in output_path without an error are skipped.
+    done = load_batch_checkpoint(output_path)
+    todo = [url for url in dict.fromkeys(urls) if url not in done]
+    semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in BATCH_CONCURRENCY.items()}
+    semaphores['default'] = threading.BoundedSemaphore(max_workers)
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    is_csv = output_path.endswith('.csv')
+    write_header = is_csv and not os.path.exists(output_path)
+    with open(output_path, 'a', newline='', encoding='utf-8') as f, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=BATCH_CSV_FIELDS) if is_csv else None
+        if write_header:
+            writer.writeheader()
+        # Profiles on platforms with bulk fetches (Instagram Actor runs, Twitter
+        # user lookups, TikTok sessions) are fetched a provider batch at a time and
+        # then fanned out to per-URL analyses; everything else is analyzed URL by URL
+        bulk_urls = {}
+        for url in todo:
+            platform = (process_social_media_url(url) or {}).get('platform')
+            if platform and get_provider(platform).batch_size > 1:
+                bulk_urls.setdefault(platform, []).append(url)
+        prefetch_batches = [(platform, platform_urls[start:start + get_provider(platform).batch_size])
+                            for platform, platform_urls in bulk_urls.items()
+                            for start in range(0, len(platform_urls), get_provider(platform).batch_size)]
+        bulk_urls = {url for platform_urls in bulk_urls.values() for url in platform_urls}
+        pending = {executor.submit(analyze_profile_url, url, openai_api_key, semaphores)
+                   for url in todo if url not in bulk_urls}
+        prefetches = {executor.submit(prefetch_profiles, platform, batch, semaphores)
+                      for platform, batch in prefetch_batches}
+        pending |= prefetches
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in prefetches:
+                    pending |= {executor.submit(analyze_profile_url, url, openai_api_key, semaphores, info)
+                                for url, info in future.result()}
+                    continue
+                result = future.result()
+                if is_csv:
+                    writer.writerow({
+                        **result,
+                        'profile': json.dumps(result['profile']),
+                        'products': json.dumps(result['products']),
+                    })
                 else:
-                    st.error(info)
-                    
-            elif profile_data['platform'] == 'youtube':
-                info = get_youtube_info(profile_data['url'])
+                    f.write(json.dumps(result) + '\n')
+                f.flush()
+                yield result
+
+class AnalysisEngine:
+    # Async facade over the fetch, recommend and image functions. analyze(url)
+    # yields event dicts ({'type': ..., 'url': ...}) as each stage produces them:
+    #   profile         {'platform', 'data'}
+    #   creator         {'data'}                 merged profile (analyze_creator only)
+    #   token           {'text'}                 streamed recommendation text
+    #   product         {'product'}              parsed ProductRecommendation
+    #   image           {'product', 'images', 'level', 'message'}
+    #   recommendations {'text'}                 full recommendation text
+    #   error           {'stage', 'message'}
+    #   done            {}                       last event of every analysis
+    # Blocking calls run in worker threads, so one event loop can drive many
+    # analyses and their stages overlap (e.g. a fetch for one URL while the LLM
+    # streams for another).
+
+    def __init__(self, openai_api_key, max_concurrent_analyses=ENGINE_MAX_CONCURRENCY,
+                 image_concurrency=UNSPLASH_MAX_CONCURRENCY):
+        self.openai_api_key = openai_api_key
+        self._analyses = asyncio.Semaphore(max_concurrent_analyses)
+        self._images = asyncio.Semaphore(image_concurrency)
+
+    async def analyze(self, url):
+        async for event in self._until_done(url, self._analyze(url)):
+            yield event
+
+    async def analyze_creator(self, urls):
+        creator = ' + '.join(urls)
+        async for event in self._until_done(creator, self._analyze_creator(creator, urls)):
+            yield event
+
+    async def _until_done(self, url, events):
+        # Every analysis ends with a done event, failed ones included; an
+        # unexpected exception is reported as an engine error first
+        try:
+            async for event in events:
+                yield event
+        except Exception as e:
+            yield {'type': 'error', 'url': url, 'stage': 'engine', 'message': str(e)}
+        yield {'type': 'done', 'url': url}
+
+    async def _analyze(self, url):
+        profile_data = process_social_media_url(url)
+        if not profile_data:
+            yield {'type': 'error', 'url': url, 'stage': 'route', 'message': 'Unsupported profile URL'}
+            return
+        platform = profile_data['platform']
+
+        async with self._analyses:
+            info = await afetch_profile_info(profile_data)
+            if not isinstance(info, dict):
+                yield {'type': 'error', 'url': url, 'stage': 'profile', 'message': info}
+                return
+            yield {'type': 'profile', 'url': url, 'platform': platform, 'data': info}
+
+            async for event in self._recommend(url, info, platform):
+                yield event
+
+    async def _analyze_creator(self, creator, urls):
+        # One creator on several platforms: the profile fetches run concurrently
+        # (latency is the slowest fetch, not the sum) and a single cross-platform
+        # recommendation is generated from the merged profile
+        routed = {}
+        for url in urls:
+            profile_data = process_social_media_url(url)
+            if not profile_data:
+                yield {'type': 'error', 'url': url, 'stage': 'route', 'message': 'Unsupported profile URL'}
+            elif profile_data['platform'] in routed:
+                yield {'type': 'error', 'url': url, 'stage': 'route',
+                       'message': f"Only one {PLATFORM_NAMES[profile_data['platform']]} profile per creator"}
+            else:
+                routed[profile_data['platform']] = profile_data
+
+        async def fetch(platform, profile_data):
+            return platform, await afetch_profile_info(profile_data)
+
+        async with self._analyses:
+            infos = {}
+            # Each profile is reported as soon as its own fetch completes
+            for fetched in asyncio.as_completed([fetch(platform, profile_data)
+                                                 for platform, profile_data in routed.items()]):
+                platform, info = await fetched
                 if isinstance(info, dict):
-                    st.subheader('Channel Information')
-                    st.write(f"Channel Name: {info['channel_name']}")
-                    st.write(f"Description: {info['description']}")
-                    st.write(f"Subscribers: {info['subscriber_count']:,}")
-                    st.write(f"Total Videos: {info['video_count']:,}")
-                    st.write(f"Total Views: {info['view_count']:,}")
-                    
-                    st.subheader('Recent Videos')
-                    for video in info['recent_videos']:
-                        st.write(f"Title: {video['title']}")
-                        st.write(f"Published: {video['published_at']}")
-                        st.write(f"Description: {video['description']}")
-                        st.write('---')
-                    
-                    st.subheader('Digital Product Recommendations')
-                    with st.spinner('Generating recommendations...'):
-                        recommendations = get_product_recommendations(info, openai_api_key, 'youtube')
-                        st.write(recommendations)
+                    infos[platform] = info
+                    yield {'type': 'profile', 'url': routed[platform]['url'], 'platform': platform, 'data': info}
                 else:
-                    st.error(info)
-                    
-            # Display Unsplash images for each product recommendation
-            def display_product_images(recommendations):
-                # Parse recommendations to extract image keywords
-                import re
-                products = re.split(r'Product \d+:', recommendations)[1:]
-                st.subheader('Product Visualizations')
-                for i, product in enumerate(products, 1):
-                    # Extract product category and image keywords
-                    category_match = re.search(r'Category: \[([^\]]+)\]', product)
-                    keywords_match = re.search(r'Image Keywords: \[([^\]]+)\]', product)
-                    
-                    if category_match and keywords_match:
-                        category = category_match.group(1)
-                        keywords = keywords_match.group(1)
-                        
-                        # Create a column layout for each product
-                        col1, col2 = st.columns([1, 2])
-                        with col1:
-                            st.write(f"Product {i}: {category}")
-                        
-                        with col2:
-                            # Get Unsplash images for the keywords
-                            images = get_unsplash_images(keywords, count=1)
-                            if images:
-                                st.image(images[0], caption=f"Visualization for {category}", use_column_width=True)
-                            else:
-                                st.warning(f"No visualization available for {category}")
-                        
-                        st.markdown("---")
+                    yield {'type': 'error', 'url': routed[platform]['url'], 'stage': 'profile', 'message': info}
+            if not infos:
+                return
+            # Keep the platform order of the input
+            merged = merge_creator_profiles({platform: infos[platform] for platform in routed if platform in infos})
+            yield {'type': 'creator', 'url': creator, 'data': merged}
+
+            async for event in self._recommend(creator, merged, 'combined'):
+                yield event
+
+    async def _recommend(self, url, info, platform):
+        # LLM tokens (from a worker thread) and finished image lookups share one
+        # queue, so images are reported while the text is still streaming
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def produce():
+            end = {'type': 'stream_end'}
+            try:
+                for chunk in stream_product_recommendations(info, self.openai_api_key, platform):
+                    loop.call_soon_threadsafe(events.put_nowait, {'type': 'token', 'text': chunk})
+            except RecommendationError as e:
+                end = {'type': 'stream_end', 'error': str(e)}
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, end)
+
+        async def find_image(record):
+            async with self._images:
+                images, level, message = await asyncio.to_thread(search_unsplash_images, record.image_keywords, 1)
+            await events.put({'type': 'image', 'url': url, 'product': record,
+                              'images': images, 'level': level, 'message': message})
+
+        producer = loop.run_in_executor(None, produce)
+        parser = ProductStreamParser()
+        recommendations = ''
+        # Keep references so pending image tasks are not garbage collected
+        image_tasks = []
+        outstanding_images = 0
+        streaming = True
+        while streaming or outstanding_images:
+            event = await events.get()
+            if event['type'] == 'image':
+                outstanding_images -= 1
+                yield event
+                continue
+            if event['type'] == 'token':
+                recommendations += event['text']
+                yield {'type': 'token', 'url': url, 'text': event['text']}
+                records = parser.feed(event['text'])
+            else:
+                streaming = False
+                await producer
+                if event.get('error'):
+                    yield {'type': 'error', 'url': url, 'stage': 'recommendations', 'message': event['error']}
+                    # Products parsed before the failure still get their images
+                    continue
+                yield {'type': 'recommendations', 'url': url, 'text': recommendations}
+                records = parser.close()
+            for record in records:
+                yield {'type': 'product', 'url': url, 'product': record}
+                image_tasks.append(asyncio.create_task(find_image(record)))
+                outstanding_images += 1
+
+    async def analyze_many(self, urls):
+        # Run several analyses at once and yield their events interleaved
+        events = asyncio.Queue()
+
+        async def pump(url):
+            try:
+                async for event in self.analyze(url):
+                    await events.put(event)
+            finally:
+                await events.put(None)
+
+        tasks = [asyncio.create_task(pump(url)) for url in urls]
+        remaining = len(tasks)
+        while remaining:
+            event = await events.get()
+            if event is None:
+                remaining -= 1
+            else:
+                yield event
+
+@traced('render.profile')
+def render_profile(info, platform):
+    if platform == 'instagram':
+        st.subheader('Profile Information')
+        st.write(f"Username: {info['username']}")
+        st.write(f"Bio: {info['biography']}")
+        st.write(f"Followers: {info['followersCount']:,}")
+        st.write(f"Following: {info['followsCount']:,}")
+        st.write(f"Total Posts: {info['postsCount']:,}")
+        if info.get('posts_analyzed'):
+            col1, col2, col3 = st.columns(3)
+            col1.metric('Engagement rate', f"{info['avg_engagement_rate']}%")
+            col2.metric('Avg likes', f"{info['avg_likes']:,}")
+            col3.metric('Posts / week', info['posts_per_week'])
+            post_types = info['post_types']
+            st.write(f"Content mix: {post_types['image']} images, {post_types['video']} videos, "
+                     f"{post_types['carousel']} carousels")
+            st.write('Top hashtags: ' + ', '.join(f'#{tag}' for tag in info['top_hashtags']))
+            st.caption(f"Based on the {info['posts_analyzed']} most recent posts")
+
+    elif platform == 'youtube':
+        st.subheader('Channel Information')
+        st.write(f"Channel Name: {info['channel_name']}")
+        st.write(f"Description: {info['description']}")
+        st.write(f"Subscribers: {info['subscriber_count']:,}")
+        st.write(f"Total Videos: {info['video_count']:,}")
+        st.write(f"Total Views: {info['view_count']:,}")
+        engagement = info.get('engagement')
+        if engagement and engagement['videos_analyzed']:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric('Engagement rate', f"{engagement['avg_engagement_rate']}%")
+            col2.metric('Median views', f"{engagement['median_views']:,}")
+            col3.metric('Uploads / week', engagement['uploads_per_week'])
+            col4.metric('Shorts', f"{engagement['shorts_ratio']:.0%}")
+            st.caption(f"Based on the {engagement['videos_analyzed']} most recent uploads")
+
+        st.subheader('Recent Videos')
+        for video in info['recent_videos']:
+            st.write(f"Title: {video['title']}")
+            st.write(f"Published: {video['published_at']}")
+            if 'views' in video:
+                st.write(f"Views: {video['views']:,} | Likes: {video['likes']:,} | Comments: {video['comments']:,}")
+            st.write(f"Description: {video['description']}")
+            st.write('---')
+
+    elif platform == 'twitter':
+        st.subheader('Profile Information')
+        st.write(f"Username: @{info['username']} ({info['name']})")
+        st.write(f"Bio: {info['description']}")
+        st.write(f"Followers: {info['followers']:,}")
+        st.write(f"Following: {info['following']:,}")
+        st.write(f"Total Tweets: {info['total_tweets']:,}")
+        if info['tweets_analyzed']:
+            col1, col2 = st.columns(2)
+            col1.metric('Engagement rate', f"{info['avg_engagement_rate']}%")
+            col2.metric('Tweets analyzed', info['tweets_analyzed'])
+            st.subheader('Recent Tweets')
+            for tweet in info['recent_tweets']:
+                st.write(tweet['text'])
+                st.caption(f"{tweet['created_at']} | Likes: {tweet['likes']:,} | Replies: {tweet['replies']:,} | "
+                           f"Retweets: {tweet['retweets']:,}")
+
+    elif platform == 'tiktok':
+        st.subheader('Profile Information')
+        st.write(f"Username: @{info['username']} ({info['nickname']})")
+        st.write(f"Bio: {info['bio']}")
+        st.write(f"Followers: {info['followers']:,}")
+        st.write(f"Following: {info['following']:,}")
+        st.write(f"Total Likes: {info['total_likes']:,}")
+        st.write(f"Total Videos: {info['video_count']:,}")
+        if info['videos_analyzed']:
+            col1, col2 = st.columns(2)
+            col1.metric('Engagement rate', f"{info['avg_engagement_rate']}%")
+            col2.metric('Avg views', f"{info['avg_views']:,}")
+            st.caption(f"Based on the {info['videos_analyzed']} most recent videos")
+
+def render_creator(creator):
+    st.subheader('Combined Audience')
+    st.write(f"Total Audience: {creator['total_audience']:,}")
+    columns = st.columns(len(creator['audience']))
+    for column, (platform, size) in zip(columns, creator['audience'].items()):
+        rate = creator['engagement_rates'][platform]
+        column.metric(PLATFORM_NAMES[platform], f'{size:,}', f"{creator['audience_share'][platform]:.0%} of audience",
+                      delta_color='off')
+        if rate is not None:
+            column.caption(f'Engagement rate: {rate}%')
+
+class AnalysisRenderer:
+    # Renders AnalysisEngine events as they arrive, from the engine directly or
+    # replayed from a job's event log. Every stage renders into its own
+    # placeholder as soon as its event arrives, and a status line above them
+    # shows which stages are still running.
+
+    def __init__(self, urls):
+        self.status = st.empty()
+        # One container per profile, laid out in input order up front, so
+        # profiles fetched concurrently keep their place whichever lands first
+        self.sections = {}
+        for url in urls:
+            profile_data = process_social_media_url(url)
+            if profile_data:
+                self.sections.setdefault(profile_data['platform'], st.container())
+        self.pending = set(self.sections)
+        self.text_placeholder = None
+        self.image_placeholders = {}
+        self.images_pending = 0
+        self.recommendations = ''
+        self.update_status()
+
+    def update_status(self):
+        if self.pending:
+            self.status.info('Fetching ' + ', '.join(PLATFORM_NAMES[platform] for platform in self.pending)
+                             + ' profile data...')
+        elif self.images_pending:
+            self.status.info(f'Generating recommendations... ({len(self.image_placeholders)} products so far, '
+                             f'{self.images_pending} images loading)')
+        else:
+            self.status.info('Generating recommendations...')
+
+    def finish(self):
+        self.status.empty()
+
+    def recommendation_section(self):
+        # Created on the first recommendation event, below every profile of the analysis
+        if self.text_placeholder is None:
             # Add image display to both Instagram and YouTube sections
             st.subheader('Digital Product Recommendations with Visuals')
-            with st.spinner('Generating recommendations and finding relevant images...'):
-                recommendations = get_product_recommendations(info, openai_api_key, platform.lower())
-                st.write(recommendations)
-                display_product_images(recommendations)
+            self.text_placeholder = st.empty()
+            st.subheader('Product Visualizations')
+        return self.text_placeholder
+
+    def handle(self, event):
+        if event['type'] == 'error':
+            platform = (process_social_media_url(event['url']) or {}).get('platform')
+            if event['stage'] == 'profile' and platform in self.sections:
+                self.pending.discard(platform)
+                self.sections[platform].error(event['message'])
+            else:
+                st.error(event['message'])
+        elif event['type'] == 'profile':
+            self.pending.discard(event['platform'])
+            with self.sections.get(event['platform']) or st.container():
+                render_profile(event['data'], event['platform'])
+        elif event['type'] == 'creator':
+            render_creator(event['data'])
+        elif event['type'] == 'token':
+            self.recommendations += event['text']
+            # JSON output is shown as the parsed products instead
+            if RECOMMENDATION_OUTPUT_MODE != 'json':
+                self.recommendation_section().markdown(self.recommendations)
+        elif event['type'] == 'product':
+            self.recommendation_section()
+            self.image_placeholders[event['product'].number] = render_product(event['product'])
+            self.images_pending += 1
+        elif event['type'] == 'image':
+            record = event['product']
+            render_product_image(self.image_placeholders[record.number], record,
+                                 (event['images'], event['level'], event['message']))
+            self.images_pending -= 1
+        elif event['type'] == 'done':
+            self.finish()
+            return
+        self.update_status()
+
+async def render_analysis(url, openai_api_key):
+    # Consume the engine's event stream and render each stage as it arrives
+    renderer = AnalysisRenderer([url])
+    async for event in AnalysisEngine(openai_api_key).analyze(url):
+        renderer.handle(event)
+    renderer.finish()
+
+async def render_creator_analysis(urls, openai_api_key):
+    renderer = AnalysisRenderer(urls)
+    async for event in AnalysisEngine(openai_api_key).analyze_creator(urls):
+        renderer.handle(event)
+    renderer.finish()
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(JOB_DB_PATH, lease_seconds=JOB_LEASE_SECONDS)
+
+def encode_event(event):
+    # JSON-serializable form of an engine event for the job event log
+    if 'product' in event:
+        event = {**event, 'product': event['product'].to_dict()}
+    return event
+
+def decode_event(event):
+    if 'product' in event:
+        event = {**event, 'product': ProductRecommendation(**event['product'])}
+    return event
+
+def use_job_queue():
+    if ANALYSIS_BACKEND == 'auto':
+        return get_job_queue().active_workers() > 0
+    return ANALYSIS_BACKEND == 'queue'
+
+def follow_job(job_id):
+    # Replay a job's events, then keep rendering new ones until it finishes.
+    # Returns False when the job does not exist (e.g. purged).
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return False
+    # Creator jobs carry one profile URL per line
+    urls = job['url'].split('\n')
+    # Everything renders into one replaceable area, so a job that runs again
+    # after its lease expired (its events are dropped) starts from a clean slate
+    area = st.empty()
+    box = area.container()
+    with box:
+        renderer = AnalysisRenderer(urls)
+    attempts = job['attempts']
+    after = 0
+    while True:
+        with box:
+            for after, event in queue.events(job_id, after):
+                renderer.handle(decode_event(event))
+        if job['status'] in FINISHED:
+            break
+        if job['status'] == 'queued':
+            renderer.status.info('Waiting for a worker...')
+        else:
+            renderer.update_status()
+        time.sleep(JOB_POLL_INTERVAL)
+        # Read the status before the events, so a finished job's log is complete
+        job = queue.get(job_id)
+        if job is None:
+            renderer.finish()
+            return False
+        if job['attempts'] != attempts or (job['status'] == 'queued' and after):
+            attempts = job['attempts']
+            box = area.container()
+            with box:
+                renderer = AnalysisRenderer(urls)
+            after = 0
+    renderer.finish()
+    return True
+
+@st.cache_resource
+def get_metrics_store():
+    return SQLiteMetricsStore(CACHE_DB_PATH)
+
+def metric_caches():
+    return {'Profile cache': get_profile_cache(), 'Recommendation cache': get_recommendation_cache(),
+            'Image cache': get_unsplash_cache()}
+
+def process_metrics():
+    # What this process measured, in the form published to the metrics store
+    return {
+        'registry': REGISTRY.snapshot(),
+        'caches': {name: cache.stats() for name, cache in metric_caches().items()},
+        'scheduler': get_scheduler().stats(),
+        'token_usage': list(get_token_usage_log()),
+    }
+
+@st.cache_resource
+def start_metrics_publisher(pid):
+    # Keyed by pid, so forked worker processes each start their own publisher
+    process = f'{socket.gethostname()}-{pid}'
+    start_publisher(get_metrics_store(), process, process_metrics, METRICS_PUBLISH_INTERVAL)
+    return process
+
+def all_metrics():
+    # This process's live metrics plus the latest published by every other
+    # process; analyses usually run in worker processes (see worker.py)
+    process = start_metrics_publisher(os.getpid())
+    snapshots = [process_metrics()] + get_metrics_store().snapshots(exclude=process)
+    registry = Registry()
+    for snapshot in snapshots:
+        registry.merge(snapshot['registry'])
+    token_usage = sorted((usage for snapshot in snapshots for usage in snapshot['token_usage']),
+                         key=lambda usage: usage['at'])
+    return {
+        'registry': registry,
+        'caches': {name: merge_cache_stats([snapshot['caches'][name] for snapshot in snapshots
+                                            if name in snapshot['caches']])
+                   for name in metric_caches()},
+        'scheduler': merge_scheduler_stats([snapshot['scheduler'] for snapshot in snapshots]),
+        'token_usage': token_usage[-TOKEN_USAGE_LOG_SIZE:],
+    }
+
+@st.cache_resource
+def start_metrics_exporter():
+    # Streamlit cannot serve extra routes, so /metrics runs on its own port
+    if METRICS_PORT:
+        return start_http_server(METRICS_PORT, render=lambda: all_metrics()['registry'].render_prometheus())
+
+def render_diagnostics(registry):
+    # Hidden panel, shown with ?diagnostics=1 in the app URL
+    with st.sidebar.expander('Diagnostics', expanded=True):
+        st.caption('Span latency over the most recent spans')
+        st.dataframe([{'span': name, **stats} for name, stats in registry.span_summary().items()])
+        st.caption('Recent spans')
+        st.dataframe([
+            {'span': record['span'], 'ms': round(record['duration'] * 1000, 1), 'error': record['error'],
+             'detail': record['detail'], **record['labels']}
+            for record in list(registry.recent)[-25:][::-1]
+        ])
+        st.caption('Prometheus metrics')
+        st.code(registry.render_prometheus(), language='text')
 
+CREATOR_OPTION = 'Multiple platforms (same creator)'
+
+# Streamlit UI
+def main():
+    st.title('Social Media Profile Analyzer & Product Recommender')
+    start_metrics_exporter()
+    start_unsplash_prefetch()
+
+    # Get OpenAI API key from environment variables
+    openai_api_key = os.getenv('OPENAI_API_KEY')
+    if not openai_api_key:
+        st.error('OpenAI API key not found in environment variables. Please add OPENAI_API_KEY to your .env file.')
+        st.stop()
+
+    # Social media platform selection
+    platform = st.selectbox('Select Platform:', ['Instagram', 'YouTube', 'Twitter/X', 'TikTok', CREATOR_OPTION])
+
+    # URL input; a creator's profiles on several platforms are analyzed together
+    if platform == CREATOR_OPTION:
+        creator_urls = [line.strip() for line in st.text_area('Enter the profile URLs, one per line:').splitlines()
+                        if line.strip()]
+        profile_url = '\n'.join(creator_urls)
     else:
-        st.error(f'Please enter a valid {platform} profile URL')
+        profile_url = st.text_input(f'Enter the {platform} profile URL:')
+
+    # Profile, recommendation and image cache metrics, over the web and worker processes
+    metrics = all_metrics()
+    for cache_name, cache_stats in metrics['caches'].items():
+        with st.sidebar.expander(cache_name):
+            st.metric('Hit rate', f"{cache_stats['hit_rate']:.0%}")
+            st.metric('Avg hit latency', f"{cache_stats['avg_hit_latency_ms']:.1f} ms")
+            st.caption(f"{cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+
+    # External API usage (calls, retries, YouTube quota units)
+    with st.sidebar.expander('API usage'):
+        st.json(metrics['scheduler'])
+
+    # Tokens per LLM request, most recent first
+    with st.sidebar.expander('LLM tokens'):
+        usage_log = metrics['token_usage'][::-1]
+        st.caption(f"Prompt budget: {PROMPT_TOKEN_BUDGET:,} tokens")
+        if usage_log:
+            st.metric('Avg prompt tokens', round(sum(usage['prompt_tokens'] for usage in usage_log) / len(usage_log)))
+            st.dataframe(usage_log)
+
+    # Background analysis jobs (see worker.py)
+    with st.sidebar.expander('Jobs'):
+        st.json({**get_job_queue().stats(), 'workers': get_job_queue().active_workers()})
 
-# Add usage instructions
-st.markdown('''
+    if st.query_params.get('diagnostics') == '1':
+        render_diagnostics(metrics['registry'])
+
+    analyze = st.button('Analyze Profile') and profile_url
+    if analyze and platform == CREATOR_OPTION:
+        refs = [process_social_media_url(url) for url in creator_urls]
+        if use_job_queue():
+            # Same creator -> same job, whatever the URL spellings or order
+            key = 'creator:' + '+'.join(sorted(ref['key'] if ref else url for ref, url in zip(refs, creator_urls)))
+            job_id = get_job_queue().enqueue(profile_url, key)
+            st.query_params['job'] = job_id
+            follow_job(job_id)
+        else:
+            st.query_params.pop('job', None)
+            asyncio.run(render_creator_analysis(creator_urls, openai_api_key))
+    elif analyze:
+        profile_data = process_social_media_url(profile_url)
+
+        if profile_data and use_job_queue():
+            # The job ID in the URL lets a refreshed page pick the analysis back up
+            job_id = get_job_queue().enqueue(profile_url, profile_data['key'])
+            st.query_params['job'] = job_id
+            follow_job(job_id)
+        elif profile_data:
+            st.query_params.pop('job', None)
+            asyncio.run(render_analysis(profile_url, openai_api_key))
+
+        else:
+            st.error(f'Please enter a valid {platform} profile URL')
+    elif st.query_params.get('job'):
+        if not follow_job(st.query_params['job']):
+            st.query_params.pop('job', None)
+
+    # Batch analysis of a CSV/JSONL list of profile URLs
+    with st.expander('Batch analysis'):
+        batch_file = st.file_uploader('Upload a CSV, JSONL or text file of profile URLs', type=['csv', 'jsonl', 'txt'])
+        if batch_file and st.button('Run Batch'):
+            urls = read_batch_urls(batch_file.getvalue().decode('utf-8').splitlines(), batch_file.name)
+            estimate = estimate_fetch_cost(urls)
+            st.caption('Estimated API usage with nothing cached: ' + ', '.join(
+                f"{api}: {totals['profiles']} profiles, {totals['calls']} calls, {totals['units']} units"
+                for api, totals in estimate.items()))
+            youtube_quota = get_scheduler().quotas['youtube']
+            if estimate.get('youtube', {}).get('units', 0) > youtube_quota.remaining:
+                st.warning(f"The batch may need more YouTube quota than the {youtube_quota.remaining:,} units left today")
+            # Same upload -> same output file, so re-running resumes from the checkpoint
+            digest = hashlib.sha256(batch_file.getvalue()).hexdigest()[:12]
+            output_path = os.path.join(BATCH_OUTPUT_DIR, f"{os.path.splitext(batch_file.name)[0]}-{digest}.jsonl")
+            progress = st.progress(0.0, text=f'Analyzing {len(urls)} profiles...')
+            for completed, result in enumerate(run_batch(urls, output_path, openai_api_key), 1):
+                progress.progress(min(completed / max(len(urls), 1), 1.0), text=f"{result['url']}: {result['error'] or 'done'}")
+            progress.progress(1.0, text='Batch complete')
+            with open(output_path, 'rb') as f:
+                st.download_button('Download results (JSONL)', f.read(), file_name=os.path.basename(output_path))
+
+    # Add usage instructions
+    st.markdown('''
 ### Instructions:
 1. Select the social media platform you want to analyze
 2. Enter your OpenAI API key to enable AI-powered product recommendations
@@ -409,4 +2251,8 @@ st.markdown('''
 **Note:** 
 - For Instagram private profiles, only basic public information will be available
 - Product recommendations are available for all social media platforms when an OpenAI API key is provided
-''')
\ No newline at end of file
+''')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import json
+import os
+import sys
+
+from app import estimate_fetch_cost, read_batch_urls, run_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze a CSV, JSONL or text file of social media profile URLs.')
+    parser.add_argument('input', help='CSV (url column), JSONL ({"url": ...}) or one URL per line')
+    parser.add_argument('-o', '--output', default='batch_results.jsonl',
+                        help='JSONL or CSV results file; existing successful rows are skipped (resume)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='maximum concurrent analyses')
+    args = parser.parse_args()
+
+    openai_api_key = os.getenv('OPENAI_API_KEY')
+    if not openai_api_key:
+        sys.exit('OPENAI_API_KEY is not set')
+
+    with open(args.input, encoding='utf-8') as f:
+        urls = read_batch_urls(f.read().splitlines(), args.input)
+    print(f'Estimated API usage with nothing cached: {json.dumps(estimate_fetch_cost(urls))}', flush=True)
+
+    kwargs = {'max_workers': args.workers} if args.workers else {}
+    failed = 0
+    for completed, result in enumerate(run_batch(urls, args.output, openai_api_key, **kwargs), 1):
+        if result['error']:
+            failed += 1
+        print(f"[{completed}] {result['url']}: {result['error'] or 'ok'}", flush=True)
+    print(f'Done: results in {args.output} ({failed} failed)')
+
+
+if __name__ == '__main__':
+    main()
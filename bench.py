@@ -0,0 +1,370 @@
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# Offline benchmark for the analysis path. The Apify, YouTube, Unsplash and
+# OpenAI clients are replaced by stand-ins that replay the recorded responses in
+# bench_fixtures/ with configurable latency and error rates, so results are
+# comparable between runs and never touch the real APIs. Prompt token counts use
+# the tiktoken encoding cached by `python tokens.py`; without it they fall back
+# to an estimate, which the report records as the tokenizer.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_fixtures')
+PROVIDERS = ('apify', 'youtube', 'unsplash', 'openai')
+# Seconds per call (openai: per streamed token) when not overridden with --latency
+DEFAULT_LATENCY = {'apify': 2.0, 'youtube': 0.08, 'unsplash': 0.15, 'openai': 0.002}
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read() if name.endswith('.txt') else json.load(f)
+
+
+def fill(template, **values):
+    # Substitute {placeholders} in every string of a JSON fixture
+    if isinstance(template, dict):
+        return {key: fill(value, **values) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fill(value, **values) for value in template]
+    if isinstance(template, str):
+        for key, value in values.items():
+            template = template.replace('{' + key + '}', str(value))
+    return template
+
+
+class FixtureHTTPError(Exception):
+    # Looks like a 503 to the scheduler's retry logic
+    status_code = 503
+
+
+class Injector:
+    def __init__(self, latency, error_rate, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, provider):
+        time.sleep(self.latency.get(provider, 0))
+        with self._lock:
+            failed = self._random.random() < self.error_rate.get(provider, 0)
+        if failed:
+            raise FixtureHTTPError(f'Injected {provider} failure')
+
+
+class FixtureApifyClient:
+    def __init__(self, inject):
+        self.inject = inject
+        self.items = load_fixture('apify_items.json')
+        self.runs = {}
+        self._lock = threading.Lock()
+
+    def actor(self, actor_id):
+        return SimpleNamespace(call=self._call)
+
+    def _call(self, run_input):
+        self.inject('apify')
+        with self._lock:
+            dataset_id = f'dataset-{len(self.runs)}'
+            self.runs[dataset_id] = run_input
+        return {'defaultDatasetId': dataset_id, 'status': 'SUCCEEDED'}
+
+    def dataset(self, dataset_id):
+        run_input = self.runs[dataset_id]
+
+        def iterate_items():
+            for url in run_input['directUrls']:
+                username = url.rstrip('/').rsplit('/', 1)[-1]
+                # Recycle the recorded posts up to the requested window
+                limit = run_input.get('resultsLimit', len(self.items))
+                for index in range(limit):
+                    item = fill(self.items[index % len(self.items)], username=username)
+                    item['id'] = f"{item['id']}-{index}"
+                    yield item
+        return SimpleNamespace(iterate_items=iterate_items)
+
+
+class FixtureYouTube:
+    # Mimics googleapiclient's resource().list(**params).execute() chain
+    def __init__(self, inject):
+        self.inject = inject
+        self.fixture = load_fixture('youtube.json')
+
+    def _request(self, handler):
+        def list_(**params):
+            return SimpleNamespace(execute=lambda: (self.inject('youtube'), handler(**params))[1])
+        return lambda: SimpleNamespace(list=list_)
+
+    def __getattr__(self, resource):
+        handler = None if resource.startswith('_') else getattr(self, f'_{resource}', None)
+        if handler is None:
+            raise AttributeError(resource)
+        return self._request(handler)
+
+    def _channels(self, part, id=None, forHandle=None, forUsername=None, **params):
+        if forHandle or forUsername:
+            return {'items': [{'id': 'UC' + (forHandle or forUsername).lstrip('@')}]}
+        return {'items': [fill(self.fixture['channel'], channel_id=channel_id) for channel_id in id.split(',')]}
+
+    def _search(self, q=None, **params):
+        return {'items': [{'id': {'kind': 'youtube#channel', 'channelId': f'UC{q}'}}]}
+
+    def _playlistItems(self, playlistId, maxResults=5, pageToken=None, **params):
+        offset = int(pageToken or 0)
+        items = []
+        for index in range(offset, offset + maxResults):
+            published_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1707000000 - index * 3 * 86400))
+            items.append({
+                'snippet': {'publishedAt': published_at},
+                'contentDetails': {'videoId': f'{playlistId}-{index}', 'videoPublishedAt': published_at},
+            })
+        return {'items': items, 'nextPageToken': str(offset + maxResults)}
+
+    def _videos(self, id, **params):
+        items = []
+        for video_id in id.split(','):
+            index = int(video_id.rsplit('-', 1)[-1])
+            published_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1707000000 - index * 3 * 86400))
+            video = fill(self.fixture['video'], video_id=video_id, channel_id=video_id[2:].rsplit('-', 1)[0],
+                         published_at=published_at)
+            if index % 3 == 2:
+                video.update(copy.deepcopy(self.fixture['short']))
+            items.append(video)
+        return {'items': items}
+
+
+class FixtureUnsplashApi:
+    def __init__(self, inject):
+        self.inject = inject
+        self.photos = load_fixture('unsplash_photos.json')
+        self.photo = SimpleNamespace(search=self._search)
+
+    def _search(self, query, per_page=10, **params):
+        self.inject('unsplash')
+        return [SimpleNamespace(id=photo['id'], urls=SimpleNamespace(**photo['urls']))
+                for photo in self.photos[:per_page]]
+
+
+def fixture_chat_model(inject, first_token_latency):
+    # A langchain chat model that replays the recorded recommendation text,
+    # token by token when streamed
+    from langchain_core.language_models.chat_models import SimpleChatModel
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+
+    response = load_fixture('openai_recommendations.txt')
+    tokens = [response[start:start + 4] for start in range(0, len(response), 4)]
+
+    class FixtureChatModel(SimpleChatModel):
+        @property
+        def _llm_type(self):
+            return 'fixture'
+
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(first_token_latency)
+            for _ in tokens:
+                inject('openai')
+            return response
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(first_token_latency)
+            for token in tokens:
+                inject('openai')
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    return FixtureChatModel()
+
+
+def install_fixtures(app, inject, first_token_latency):
+    from scheduler import RequestScheduler
+
+    apify = FixtureApifyClient(inject)
+    youtube = FixtureYouTube(inject)
+    unsplash = FixtureUnsplashApi(inject)
+    llm = fixture_chat_model(inject, first_token_latency)
+    # No rate limits offline, but keep retries so injected errors exercise them
+    scheduler = RequestScheduler({provider: (1e9, 1e9) for provider in PROVIDERS}, base_delay=0.01)
+    app.get_apify_client = lambda: apify
+    app.get_youtube_client = lambda: youtube
+    app.get_unsplash_api = lambda: unsplash
+    app.get_llm = lambda openai_api_key, streaming=False: llm
+    app.get_scheduler = lambda: scheduler
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+        'p50_ms': pick(0.50),
+        'p90_ms': pick(0.90),
+        'p99_ms': pick(0.99),
+    }
+
+
+def time_stage(fn, iterations, is_error=lambda result: False):
+    samples, errors = [], 0
+    for i in range(iterations):
+        start = time.perf_counter()
+        result = fn(i)
+        samples.append(time.perf_counter() - start)
+        errors += bool(is_error(result))
+    return {**percentiles(samples), 'errors': errors}
+
+
+def bench_stages(app, iterations, run_id):
+    recommendations = load_fixture('openai_recommendations.txt')
+    youtube_info = app.get_youtube_info(f"https://www.youtube.com/channel/UC{'warmup' + str(run_id):_>22}")
+    not_dict = lambda result: not isinstance(result, dict)
+    return {
+        # Unique identifiers per iteration so the profile and LLM caches miss
+        'get_instagram_info': time_stage(
+            lambda i: app.get_instagram_info(f'creator{run_id}x{i}'), iterations, not_dict),
+        'get_youtube_info': time_stage(
+            lambda i: app.get_youtube_info(f'https://www.youtube.com/@creator{run_id}x{i}'), iterations, not_dict),
+        'get_unsplash_images': time_stage(
+            lambda i: app.get_unsplash_images(f'laptop workspace {run_id} {i}', count=1), iterations,
+            lambda result: not result),
+        'get_product_recommendations': time_stage(
+            lambda i: app.get_product_recommendations(
+                {**youtube_info, 'channel_name': f'{youtube_info["channel_name"]} {run_id}x{i}'}, 'benchmark', 'youtube'),
+            iterations, lambda result: result.startswith('Error')),
+        'display_product_images': time_stage(
+            lambda i: app.display_product_images(recommendations), iterations),
+    }
+
+
+def bench_throughput(app, concurrency, run_id):
+    # N concurrent end-to-end analyses through the AnalysisEngine
+    urls = [f'https://www.youtube.com/@throughput{run_id}x{i}' for i in range(concurrency)]
+    first_product = {}
+    done = {}
+    errors = 0
+
+    async def run():
+        nonlocal errors
+        engine = app.AnalysisEngine('benchmark', max_concurrent_analyses=concurrency)
+        async for event in engine.analyze_many(urls):
+            elapsed = time.perf_counter() - start
+            if event['type'] == 'product':
+                first_product.setdefault(event['url'], elapsed)
+            elif event['type'] == 'done':
+                done[event['url']] = elapsed
+            elif event['type'] == 'error':
+                errors += 1
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    asyncio.run(run())
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'concurrency': concurrency,
+        'wall_s': round(wall, 3),
+        'analyses_per_s': round(len(done) / wall, 3) if wall else 0.0,
+        'completed': len(done),
+        'errors': errors,
+        'time_to_first_product': percentiles(list(first_product.values())),
+        'time_to_done': percentiles(list(done.values())),
+        'peak_traced_memory_mb': round(peak / 2 ** 20, 2),
+    }
+
+
+def compare(report, baseline, threshold):
+    # Flag any stage whose p50/p90 grew by more than `threshold` (fraction)
+    regressions = []
+    for stage, stats in report['stages'].items():
+        for metric in ('p50_ms', 'p90_ms'):
+            before = baseline.get('stages', {}).get(stage, {}).get(metric)
+            after = stats.get(metric)
+            if before and after and after > before * (1 + threshold):
+                regressions.append(f'{stage} {metric}: {before} -> {after}')
+    before = baseline.get('throughput', {}).get('analyses_per_s')
+    after = report['throughput']['analyses_per_s']
+    if before and after < before * (1 - threshold):
+        regressions.append(f'throughput analyses_per_s: {before} -> {after}')
+    return regressions
+
+
+def parse_provider_values(values, defaults):
+    # "apify=1.5,openai=0.02" -> {'apify': 1.5, 'openai': 0.02, ...}
+    result = dict(defaults)
+    for pair in filter(None, (values or '').split(',')):
+        provider, value = pair.split('=')
+        if provider not in PROVIDERS:
+            raise SystemExit(f'Unknown provider {provider!r}; expected one of {", ".join(PROVIDERS)}')
+        result[provider] = float(value)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the profile analysis path.')
+    parser.add_argument('--iterations', type=int, default=20, help='calls per stage')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent analyses for the throughput run')
+    parser.add_argument('--latency', help='per-provider latency in seconds, e.g. apify=2,youtube=0.05')
+    parser.add_argument('--error-rate', help='per-provider error probability, e.g. youtube=0.05')
+    parser.add_argument('--first-token-latency', type=float, default=0.5, help='seconds before the first LLM token')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='bench_report.json')
+    parser.add_argument('--compare', help='previous report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before flagging (fraction)')
+    args = parser.parse_args()
+
+    latency = parse_provider_values(args.latency, DEFAULT_LATENCY)
+    error_rate = parse_provider_values(args.error_rate, {})
+
+    # Isolated caches so every run starts cold
+    os.environ['CACHE_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'cache.sqlite')
+    os.environ.setdefault('UNSPLASH_ACCESS_KEY', 'benchmark')
+    # The recommendation stage varies only the channel name, which stored
+    # recommendations would otherwise be reused for; always generate
+    os.environ['RECOMMENDATION_REFRESH_THRESHOLD'] = '0'
+    import app
+    import tokens
+    install_fixtures(app, Injector(latency, error_rate, args.seed), args.first_token_latency)
+
+    run_id = int(time.time())
+    report = {
+        'config': {
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'latency_s': latency,
+            'error_rate': error_rate,
+            'first_token_latency_s': args.first_token_latency,
+            'seed': args.seed,
+            'python': sys.version.split()[0],
+            'tokenizer': 'tiktoken' if tokens.get_encoding(app.LLM_MODEL) else 'estimate',
+        },
+        'stages': bench_stages(app, args.iterations, run_id),
+        'throughput': bench_throughput(app, args.concurrency, run_id),
+    }
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['regressions'] = compare(report, json.load(f), args.threshold)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit('Performance regressions:\n  ' + '\n  '.join(report['regressions']))
+
+
+if __name__ == '__main__':
+    main()
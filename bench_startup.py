@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Runs app.py the way Streamlit does (as __main__, in bare mode here): the first
+# run is the cold start, later runs re-execute the script with warm sys.modules
+# and st.cache_resource, like a rerun after a widget interaction.
+RUN_SNIPPET = """
+import json, runpy, sys, time
+sys.path.insert(0, '.')
+t = time.perf_counter()
+runpy.run_path('app.py', run_name='__main__')
+cold = time.perf_counter() - t
+reruns = []
+for _ in range({reruns}):
+    t = time.perf_counter()
+    runpy.run_path('app.py', run_name='__main__')
+    reruns.append(time.perf_counter() - t)
+print(json.dumps({{'cold': cold, 'reruns': reruns}}))
+"""
+
+
+def measure(directory, processes, reruns):
+    env = dict(os.environ)
+    # Keep the UI from stopping early and keep caches out of the working tree
+    env.setdefault('OPENAI_API_KEY', 'benchmark')
+    scratch = tempfile.mkdtemp()
+    env['CACHE_DB_PATH'] = os.path.join(scratch, 'bench.sqlite')
+    env['JOB_DB_PATH'] = os.path.join(scratch, 'jobs.sqlite')
+    cold, rerun = [], []
+    for _ in range(processes):
+        output = subprocess.run(
+            [sys.executable, '-c', RUN_SNIPPET.format(reruns=reruns)],
+            cwd=directory, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        cold.append(sample['cold'])
+        rerun.extend(sample['reruns'])
+    return {
+        'cold_start_ms': summarize(cold),
+        'rerun_ms': summarize(rerun),
+    }
+
+
+def summarize(samples):
+    samples = sorted(sample * 1000 for sample in samples)
+    return {
+        'median': round(statistics.median(samples), 2),
+        'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+        'samples': len(samples),
+    }
+
+
+def export_revision(ref):
+    # Check out a git revision into a temporary directory for comparison
+    directory = tempfile.mkdtemp(prefix='bench-startup-')
+    archive = subprocess.run(['git', 'archive', ref], capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure app.py cold start and rerun latency.')
+    parser.add_argument('--processes', type=int, default=5, help='fresh interpreter processes (cold starts)')
+    parser.add_argument('--reruns', type=int, default=20, help='reruns measured per process')
+    parser.add_argument('--baseline', help='git revision to compare against, e.g. HEAD~1')
+    parser.add_argument('-o', '--output', help='write the JSON report here as well')
+    args = parser.parse_args()
+
+    report = {'current': measure('.', args.processes, args.reruns)}
+    if args.baseline:
+        report['baseline'] = {'ref': args.baseline,
+                              **measure(export_revision(args.baseline), args.processes, args.reruns)}
+        for metric in ('cold_start_ms', 'rerun_ms'):
+            report.setdefault('speedup', {})[metric] = round(
+                report['baseline'][metric]['median'] / report['current'][metric]['median'], 2)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import json
+import random
+import string
+import time
+
+from urls import parse_profile_url
+
+# Real-world spellings of profile URLs: share-sheet query strings, mobile and
+# bare hosts, trailing paths, video links. Each template maps to the key it
+# must produce (None means the URL must be rejected).
+TEMPLATES = [
+    ('https://www.instagram.com/{name}/', 'instagram:username:{lower}'),
+    ('https://instagram.com/{name}?igsh=MWd2dGx4YjRiMW5odQ==', 'instagram:username:{lower}'),
+    ('instagram.com/{name}', 'instagram:username:{lower}'),
+    ('https://www.instagram.com/{name}/reels/', 'instagram:username:{lower}'),
+    ('https://www.instagram.com/stories/{name}/3301234567890123456/', 'instagram:username:{lower}'),
+    ('https://www.instagram.com/p/C3xAbCdEfGh/', None),
+    ('https://www.youtube.com/@{name}', 'youtube:handle:@{lower}'),
+    ('https://youtube.com/@{name}?si=Xyz123AbC', 'youtube:handle:@{lower}'),
+    ('https://m.youtube.com/@{name}/videos', 'youtube:handle:@{lower}'),
+    ('https://www.youtube.com/user/{name}', 'youtube:username:{lower}'),
+    ('https://m.youtube.com/user/{name}/featured', 'youtube:username:{lower}'),
+    ('https://www.youtube.com/c/{name}', 'youtube:custom:{lower}'),
+    ('https://www.youtube.com/{name}', 'youtube:custom:{lower}'),
+    ('https://www.youtube.com/channel/{channel_id}', 'youtube:channel_id:{channel_id}'),
+    ('https://youtu.be/{video_id}?si=AbCdEf', 'youtube:video:{video_id}'),
+    ('https://www.youtube.com/watch?v={video_id}&t=42s', 'youtube:video:{video_id}'),
+    ('https://www.youtube.com/shorts/{video_id}', 'youtube:video:{video_id}'),
+    ('https://www.youtube.com/results?search_query={name}', None),
+    ('https://x.com/{name}', 'twitter:username:{short}'),
+    ('https://twitter.com/{name}/status/1757000000000000000', 'twitter:username:{short}'),
+    ('https://mobile.twitter.com/{name}?s=20', 'twitter:username:{short}'),
+    ('https://netflix.com/{name}', None),
+    ('https://www.tiktok.com/@{name}?lang=en', 'tiktok:username:{lower}'),
+    ('https://www.tiktok.com/@{name}/video/7331234567890123456', 'tiktok:username:{lower}'),
+    ('https://example.com/instagram.com/{name}', None),
+    ('not a url', None),
+]
+
+
+def legacy_process_social_media_url(url):
+    # The substring router this module replaced, kept for comparison
+    if 'instagram.com' in url:
+        return {'platform': 'instagram', 'username': url.split('instagram.com/')[1].split('/')[0]}
+    elif 'youtube.com' in url:
+        return {'platform': 'youtube', 'url': url}
+    elif 'twitter.com' in url or 'x.com' in url:
+        return {'platform': 'twitter', 'username': url.split('/')[-1]}
+    elif 'tiktok.com' in url:
+        return {'platform': 'tiktok', 'username': url.split('/@')[-1].split('?')[0]}
+    return None
+
+
+def build_corpus(size, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        template, expected = rng.choice(TEMPLATES)
+        name = ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(rng.randint(4, 14)))
+        values = {
+            'name': name,
+            'lower': name.lower(),
+            'short': name.lower()[:15],
+            'channel_id': 'UC' + ''.join(rng.choice(string.ascii_letters + string.digits + '-_') for _ in range(22)),
+            'video_id': ''.join(rng.choice(string.ascii_letters + string.digits + '-_') for _ in range(11)),
+        }
+        if '{short}' in (expected or ''):
+            values['name'] = values['short']
+        corpus.append((template.format(**values), expected.format(**values) if expected else None))
+    return corpus
+
+
+def time_router(router, urls, repeats):
+    # Memoization is bypassed so every URL is actually parsed
+    router = getattr(router, '__wrapped__', router)
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for url in urls:
+            router(url)
+        best = min(best, time.perf_counter() - start)
+    return round(best / len(urls) * 1e9, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark profile URL parsing and routing.')
+    parser.add_argument('-n', '--size', type=int, default=100000, help='URLs in the generated corpus')
+    parser.add_argument('--repeats', type=int, default=5, help='timed passes; the best is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size, args.seed)
+    urls = [url for url, _ in corpus]
+    mismatches = [(url, expected, getattr(parse_profile_url(url), 'key', None))
+                  for url, expected in corpus if getattr(parse_profile_url(url), 'key', None) != expected]
+    # URLs the old router accepted although they are not profiles
+    legacy_false_accepts = sum(1 for url, expected in corpus
+                               if expected is None and _safe(legacy_process_social_media_url, url))
+
+    report = {
+        'urls': len(corpus),
+        'parse_profile_url_ns': time_router(parse_profile_url, urls, args.repeats),
+        'legacy_router_ns': time_router(lambda url: _safe(legacy_process_social_media_url, url), urls, args.repeats),
+        'mismatches': len(mismatches),
+        'legacy_false_accepts': legacy_false_accepts,
+        'examples': mismatches[:5],
+    }
+    print(json.dumps(report, indent=2))
+
+
+def _safe(router, url):
+    # The legacy router raises IndexError on some inputs
+    try:
+        return router(url)
+    except IndexError:
+        return None
+
+
+if __name__ == '__main__':
+    main()
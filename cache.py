@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import inc
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry TTLs (same interface as SQLiteCache)."""
+
+    def __init__(self, max_entries=1000, default_ttl=3600, name='memory'):
+        self.name = name
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+
+    def get(self, key):
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                inc('cache_requests_total', cache=self.name, result='miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.hit_seconds += time.perf_counter() - start
+        inc('cache_requests_total', cache=self.name, result='hit')
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __contains__(self, key):
+        # Unexpired presence check that neither counts as a lookup nor refreshes recency
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return _stats(self.hits, self.misses, self.hit_seconds, len(self))
+
+
+class SQLiteCache:
+    """Size-bounded LRU cache with per-entry TTLs, persisted in a SQLite table.
+
+    Values must be JSON-serializable. Several caches can share one database
+    file by using different table names.
+    """
+
+    def __init__(self, path, table, max_entries=1000, default_ttl=3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.table = table
+        self.name = table
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)')
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+
+    def get(self, key):
+        start = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                self.misses += 1
+                inc('cache_requests_total', cache=self.name, result='miss')
+                return None
+            self._conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        value = json.loads(row[0])
+        with self._lock:
+            self.hits += 1
+            self.hit_seconds += time.perf_counter() - start
+        inc('cache_requests_total', cache=self.name, result='hit')
+        return value
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        payload = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, payload, expires_at, now),
+            )
+            # Drop expired rows, then evict least recently used rows beyond the size bound
+            self._conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+            self._conn.execute(
+                f'DELETE FROM {self.table} WHERE key IN ('
+                f'SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def __contains__(self, key):
+        # Unexpired presence check that neither counts as a lookup nor refreshes recency
+        with self._lock:
+            return self._conn.execute(
+                f'SELECT 1 FROM {self.table} WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def stats(self):
+        return _stats(self.hits, self.misses, self.hit_seconds, len(self))
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution.
+
+    The first caller (the leader) runs the work; callers arriving while it is
+    in flight wait and receive the same return value or exception. Nothing is
+    remembered once the call completes; pair it with a cache for that.
+    """
+
+    def __init__(self, name='singleflight'):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def join(self, key):
+        # Returns (flight, is_leader); the leader must call finish() exactly once
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        inc('singleflight_requests_total', flight=self.name, result='leader' if leader else 'shared')
+        return flight, leader
+
+    def finish(self, key, flight, value=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.value = value
+        flight.error = error
+        flight.done.set()
+
+    def do(self, key, fn, *args, **kwargs):
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait()
+        try:
+            value = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, value=value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        return {'leaders': self.leaders, 'shared': self.shared, 'in_flight': in_flight}
+
+
+def _stats(hits, misses, hit_seconds, entries):
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / lookups if lookups else 0.0,
+        'avg_hit_latency_ms': hit_seconds / hits * 1000 if hits else 0.0,
+        'entries': entries,
+    }
+
+
+def merge_cache_stats(stats):
+    # Totals over stats() of the same cache in several processes. Shared SQLite
+    # tables report the same entry count everywhere, so the largest is kept.
+    hits = sum(item['hits'] for item in stats)
+    hit_seconds = sum(item['avg_hit_latency_ms'] * item['hits'] / 1000 for item in stats)
+    return _stats(hits, sum(item['misses'] for item in stats), hit_seconds,
+                  max((item['entries'] for item in stats), default=0))
@@ -0,0 +1,176 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import inc
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+class JobQueue:
+    """Analysis job queue persisted in SQLite, shared by the web and worker processes.
+
+    Jobs are claimed atomically (BEGIN IMMEDIATE), so any number of worker
+    processes can poll the same database. Running jobs hold a lease that the
+    worker renews with heartbeat(); jobs whose worker died are requeued up to
+    max_attempts times. Each job has an ordered event log that the UI replays
+    and follows, so progress survives browser refreshes.
+    """
+
+    def __init__(self, path, lease_seconds=120, max_attempts=3, retention_seconds=24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, key TEXT NOT NULL, url TEXT NOT NULL, status TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, error TEXT, created_at REAL NOT NULL, '
+            'started_at REAL, heartbeat_at REAL, finished_at REAL);'
+            'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);'
+            'CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);'
+            'CREATE TABLE IF NOT EXISTS job_events ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, event TEXT NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq);'
+            'CREATE TABLE IF NOT EXISTS job_workers (id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL);'
+        )
+
+    def enqueue(self, url, key=None):
+        # Returns the job ID; an unfinished job for the same key is reused, so
+        # concurrent requests for one profile share one job
+        key = key or url
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1',
+                    (key, QUEUED, RUNNING),
+                ).fetchone()
+                if row:
+                    job_id = row[0]
+                else:
+                    job_id = uuid.uuid4().hex
+                    self._conn.execute(
+                        'INSERT INTO jobs (id, key, url, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                        (job_id, key, url, QUEUED, now),
+                    )
+                self._purge(now)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        inc('jobs_total', result='shared' if row else 'enqueued')
+        return job_id
+
+    def claim(self, worker):
+        # Atomically take the oldest queued job; returns its row dict or None
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._requeue_expired(now)
+                row = self._conn.execute(
+                    'SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, '
+                        'started_at = ?, heartbeat_at = ? WHERE id = ?',
+                        (RUNNING, worker, now, now, row[0]),
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self.get(row[0]) if row else None
+
+    def _requeue_expired(self, now):
+        # Jobs whose worker stopped renewing the lease; their partial events are dropped
+        expired = [job_id for job_id, in self._conn.execute(
+            'SELECT id FROM jobs WHERE status = ? AND heartbeat_at < ?', (RUNNING, now - self.lease_seconds)
+        )]
+        for job_id in expired:
+            self._conn.execute('DELETE FROM job_events WHERE job_id = ?', (job_id,))
+            self._conn.execute(
+                'UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                "error = CASE WHEN attempts >= ? THEN 'Worker stopped responding' ELSE NULL END, "
+                'finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END, worker = NULL WHERE id = ?',
+                (self.max_attempts, FAILED, QUEUED, self.max_attempts, self.max_attempts, now, job_id),
+            )
+            inc('jobs_expired_total')
+
+    def _purge(self, now):
+        cutoff = now - self.retention_seconds
+        self._conn.execute(
+            'DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?)',
+            (*FINISHED, cutoff),
+        )
+        self._conn.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?', (*FINISHED, cutoff))
+
+    def heartbeat(self, job_ids, worker=None):
+        # Renew the lease of running jobs (and register the worker as alive)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?',
+                [(now, job_id, RUNNING) for job_id in job_ids],
+            )
+            if worker:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO job_workers (id, heartbeat_at) VALUES (?, ?)', (worker, now)
+                )
+
+    def active_workers(self, max_age=30):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM job_workers WHERE heartbeat_at >= ?', (time.time() - max_age,)
+            ).fetchone()[0]
+
+    def add_event(self, job_id, event):
+        # event must be JSON-serializable
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO job_events (job_id, event) VALUES (?, ?)', (job_id, json.dumps(event))
+            )
+
+    def events(self, job_id, after=0):
+        # [(seq, event)] in order; pass the last seq seen to follow a running job
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT seq, event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq', (job_id, after)
+            ).fetchall()
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+    def finish(self, job_id, error=None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                (FAILED if error else DONE, error, time.time(), job_id),
+            )
+        inc('jobs_finished_total', result='failed' if error else 'done')
+
+    def get(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)}
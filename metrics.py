@@ -0,0 +1,245 @@
+import contextlib
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets (seconds) for external calls, which range from a few ms
+# (cache hits) to minutes (Apify actor runs)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+METRIC_PREFIX = 'analyzer_'
+
+
+class Registry:
+    """Thread-safe counters and latency histograms with a Prometheus text renderer.
+
+    Also keeps the most recent spans (with free-form detail that is never
+    exported as a label) for the diagnostics panel.
+    """
+
+    def __init__(self, recent_spans=1000):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.recent = deque(maxlen=recent_spans)
+
+    def snapshot(self):
+        # JSON-serializable copy of the counters, histograms and recent spans
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), dict(histogram, buckets=list(histogram['buckets']))]
+                               for (name, labels), histogram in self.histograms.items()],
+                'recent': list(self.recent),
+            }
+
+    def merge(self, snapshot):
+        # Add another registry's snapshot (e.g. from another process) to this one
+        with self._lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, other in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+                histogram['buckets'] = [count + added for count, added in zip(histogram['buckets'], other['buckets'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+            recent = sorted(list(self.recent) + snapshot['recent'], key=lambda record: record['at'])
+            self.recent = deque(recent[-self.recent.maxlen:], maxlen=self.recent.maxlen)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def record_span(self, name, duration, error, detail, labels):
+        self.observe('span_duration_seconds', duration, span=name, **labels)
+        if error:
+            self.inc('span_errors_total', span=name, **labels)
+        self.recent.append({'span': name, 'duration': duration, 'error': error, 'detail': detail,
+                            'labels': labels, 'at': time.time()})
+
+    def span_summary(self):
+        # Per-span latency over the recent window: count, errors, mean/p50/p95/max in ms
+        grouped = {}
+        for record in list(self.recent):
+            grouped.setdefault(record['span'], []).append(record)
+        summary = {}
+        for name, records in sorted(grouped.items()):
+            durations = sorted(record['duration'] * 1000 for record in records)
+            summary[name] = {
+                'count': len(durations),
+                'errors': sum(record['error'] for record in records),
+                'mean_ms': round(sum(durations) / len(durations), 1),
+                'p50_ms': round(durations[len(durations) // 2], 1),
+                'p95_ms': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 1),
+                'max_ms': round(durations[-1], 1),
+            }
+        return summary
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value['buckets'])))
+                                for key, value in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            metric = METRIC_PREFIX + name
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                lines.append(f'{metric}_bucket{_labels(labels + (("le", repr(bound)),))} {count}')
+            lines.append(f'{metric}_bucket{_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{metric}_sum{_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{metric}_count{_labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Module state survives Streamlit reruns (imported modules are cached), so this
+# registry is process-wide
+REGISTRY = Registry()
+
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+@contextlib.contextmanager
+def span(name, detail=None, **labels):
+    # Time a block as a tracing span; labels are exported, detail is only kept
+    # in the recent-spans window (use it for high-cardinality values like handles)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        REGISTRY.record_span(name, time.perf_counter() - start, error, detail, labels)
+
+
+def traced(name, **labels):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SQLiteMetricsStore:
+    """Latest metrics snapshot of each process in SQLite.
+
+    Worker processes publish what they measured here, so the web process can
+    display and export metrics for all of them. Snapshots of processes that
+    stopped publishing are kept for retention_seconds, so their counters do not
+    vanish from the totals as soon as the process exits.
+    """
+
+    def __init__(self, path, retention_seconds=24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS process_metrics ('
+            'process TEXT PRIMARY KEY, updated_at REAL NOT NULL, payload TEXT NOT NULL)'
+        )
+
+    def publish(self, process, payload):
+        # payload must be JSON-serializable
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO process_metrics (process, updated_at, payload) VALUES (?, ?, ?)',
+                               (process, now, json.dumps(payload, default=str)))
+            self._conn.execute('DELETE FROM process_metrics WHERE updated_at < ?', (now - self.retention_seconds,))
+
+    def snapshots(self, exclude=None):
+        # Latest payload of every process except `exclude`
+        with self._lock:
+            rows = self._conn.execute('SELECT process, payload FROM process_metrics').fetchall()
+        return [json.loads(payload) for process, payload in rows if process != exclude]
+
+
+def start_publisher(store, process, collect, interval=10.0):
+    # Publish collect() to the store under `process` every `interval` seconds
+    # from a daemon thread
+    def run():
+        while True:
+            try:
+                store.publish(process, collect())
+            except Exception:
+                # Metrics must never take the process down; the next round retries
+                pass
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='metrics-publisher', daemon=True)
+    thread.start()
+    return thread
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='0.0.0.0', render=None):
+    # Serve /metrics in Prometheus text format from a daemon thread; render
+    # (default: this process's REGISTRY) returns the exposition text
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.render = render or REGISTRY.render_prometheus
+    threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True).start()
+    return server
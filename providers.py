@@ -0,0 +1,94 @@
+import asyncio
+from collections import namedtuple
+
+from metrics import span
+
+# Expected cost of a fetch: external calls and quota units charged to the
+# scheduler provider `api` (e.g. 'apify', 'youtube')
+CostHint = namedtuple('CostHint', ['api', 'calls', 'units'])
+
+
+class ProfileProvider:
+    """Fetches creator profiles for one platform.
+
+    Subclasses implement fetch_batch(profiles): a blocking call that fetches up
+    to batch_size profiles (profile_data dicts from process_social_media_url)
+    and returns {profile key: profile dict or error string}. On top of it the
+    base class serves cached profiles, shares one fetch between concurrent
+    requests for the same profile, and splits bulk requests into batches, so
+    every platform gets the same caching and batching. Error strings are never
+    cached.
+    """
+
+    platform = None
+    # Scheduler provider the fetches are charged to (rate limit, quota)
+    api = None
+    # Profiles fetched per fetch_batch call
+    batch_size = 1
+    # External calls per fetch_batch call and per profile, and quota units per call
+    calls_per_batch = 1
+    calls_per_profile = 0
+    units_per_call = 1
+
+    def __init__(self, cache=None, flight=None, ttl=3600):
+        self.cache = cache
+        self.flight = flight
+        self.ttl = ttl
+
+    def fetch_batch(self, profiles):
+        raise NotImplementedError
+
+    def _cached(self, key):
+        return self.cache.get(key) if self.cache is not None else None
+
+    def _fetch_and_store(self, profiles):
+        with span('profile.fetch', detail=','.join(profile_data['key'] for profile_data in profiles),
+                  platform=self.platform):
+            results = self.fetch_batch(profiles)
+        if self.cache is not None:
+            for key, info in results.items():
+                if isinstance(info, dict):
+                    self.cache.set(key, info, ttl=self.ttl)
+        return results
+
+    def fetch(self, profile_data):
+        key = profile_data['key']
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        def fetch_once():
+            # A flight that finished just before this one joined has filled the cache
+            if self.cache is not None and key in self.cache:
+                return self.cache.get(key)
+            return self._fetch_and_store([profile_data])[key]
+
+        return self.flight.do(key, fetch_once) if self.flight else fetch_once()
+
+    def fetch_many(self, profiles):
+        # {profile key: info}; cached profiles are served from the cache and
+        # only the misses are fetched, batch_size at a time
+        results = {}
+        misses = {}
+        for profile_data in profiles:
+            cached = self._cached(profile_data['key'])
+            if cached is not None:
+                results[profile_data['key']] = cached
+            else:
+                misses.setdefault(profile_data['key'], profile_data)
+        misses = list(misses.values())
+        for start in range(0, len(misses), self.batch_size):
+            results.update(self._fetch_and_store(misses[start:start + self.batch_size]))
+        return results
+
+    async def afetch(self, profile_data):
+        return await asyncio.to_thread(self.fetch, profile_data)
+
+    async def afetch_many(self, profiles):
+        return await asyncio.to_thread(self.fetch_many, profiles)
+
+    def cost(self, profiles):
+        # Upper-bound hint for fetching profiles with nothing cached
+        batches = -(-len(profiles) // self.batch_size)
+        calls = batches * self.calls_per_batch + len(profiles) * self.calls_per_profile
+        return CostHint(self.api, calls, calls * self.units_per_call)
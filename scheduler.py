@@ -0,0 +1,315 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from metrics import inc
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+_request_priority = contextvars.ContextVar('request_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    # Calls made inside this block (on the current thread/task) use the given priority
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class SQLiteLimitStore:
+    """Token bucket and daily quota state in SQLite, shared by every process
+    (web and workers) that opens the same database.
+
+    Each update runs in its own BEGIN IMMEDIATE transaction, so processes see
+    one bucket and one quota per provider instead of one each.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS rate_buckets ('
+            'provider TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS quota_usage ('
+            'provider TEXT NOT NULL, day TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (provider, day));'
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def take(self, provider, tokens, rate, capacity, floor=0):
+        # Take tokens from the shared bucket, leaving at least `floor`; returns 0
+        # on success, otherwise the seconds until enough tokens will have
+        # accumulated. Wall-clock time, as monotonic clocks are not comparable
+        # across processes.
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE provider = ?', (provider,)).fetchone()
+            available = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+            wait = 0 if available - tokens >= floor else (tokens + floor - available) / rate
+            if not wait:
+                available -= tokens
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (provider, tokens, updated_at) VALUES (?, ?, ?)',
+                         (provider, available, now))
+        return wait
+
+    def charge(self, provider, day, units, limit):
+        # Add units to the provider's usage for `day`; raises QuotaExceededError
+        # (charging nothing) when that would exceed limit
+        with self._transaction() as conn:
+            row = conn.execute('SELECT used FROM quota_usage WHERE provider = ? AND day = ?', (provider, day)).fetchone()
+            used = row[0] if row else 0
+            if used + units > limit:
+                raise QuotaExceededError(f'Daily quota exhausted ({used}/{limit} units used, {units} requested)')
+            if row is None:
+                conn.execute('DELETE FROM quota_usage WHERE provider = ? AND day < ?', (provider, day))
+            conn.execute('INSERT OR REPLACE INTO quota_usage (provider, day, used) VALUES (?, ?, ?)',
+                         (provider, day, used + units))
+        return used + units
+
+    def used(self, provider, day):
+        with self._lock:
+            row = self._conn.execute('SELECT used FROM quota_usage WHERE provider = ? AND day = ?',
+                                     (provider, day)).fetchone()
+        return row[0] if row else 0
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens/second up to `capacity`.
+
+    Waiting callers are served strictly in priority order (then FIFO), so an
+    interactive request never queues behind batch work for the same provider.
+    With a store, the tokens themselves live in the store under `name` and are
+    shared with other processes; the priority order applies within a process.
+    Across processes, lower-priority calls only take tokens while `reserve` of
+    them remain afterwards, so batch work elsewhere cannot drain the burst
+    interactive requests need.
+    """
+
+    def __init__(self, rate, capacity, store=None, name=None, reserve=0):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = reserve
+        self.tokens = capacity
+        self.store = store
+        self.name = name
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, tokens, floor=0):
+        # 0 when the tokens were taken, otherwise the seconds to wait for them
+        if self.store is not None:
+            return self.store.take(self.name, tokens, self.rate, self.capacity, floor)
+        self._refill()
+        if self.tokens - tokens >= floor:
+            self.tokens -= tokens
+            return 0
+        return (tokens + floor - self.tokens) / self.rate
+
+    def acquire(self, tokens=1, priority=PRIORITY_INTERACTIVE, timeout=None):
+        tokens = min(tokens, self.capacity)
+        floor = min(self.reserve, self.capacity - tokens) if priority > PRIORITY_INTERACTIVE else 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == entry:
+                        wait = self._take(tokens, floor)
+                        if not wait:
+                            return
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise RateLimitTimeout(f'Timed out waiting {timeout}s for a rate limit slot')
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+
+class QuotaBudget:
+    """Daily quota-unit budget that resets at midnight in the provider's timezone.
+
+    With a store, usage is kept in the store under `name`, so every process
+    draws from the same daily budget.
+    """
+
+    def __init__(self, daily_units, timezone='America/Los_Angeles', store=None, name=None):
+        self.daily_units = daily_units
+        self.timezone = ZoneInfo(timezone)
+        self.store = store
+        self.name = name
+        self._used = 0
+        self._day = None
+        self._lock = threading.Lock()
+
+    def _today(self):
+        return datetime.now(self.timezone).date()
+
+    def charge(self, units):
+        if self.store is not None:
+            self.store.charge(self.name, self._today().isoformat(), units, self.daily_units)
+            return
+        with self._lock:
+            today = self._today()
+            if today != self._day:
+                self._day = today
+                self._used = 0
+            if self._used + units > self.daily_units:
+                raise QuotaExceededError(
+                    f'Daily quota exhausted ({self._used}/{self.daily_units} units used, {units} requested)'
+                )
+            self._used += units
+
+    @property
+    def used(self):
+        if self.store is not None:
+            return self.store.used(self.name, self._today().isoformat())
+        return self._used if self._day == self._today() else 0
+
+    @property
+    def remaining(self):
+        return max(self.daily_units - self.used, 0)
+
+
+def status_code(exc):
+    # HTTP status of an error raised by requests, googleapiclient, openai or apify-client
+    for candidate in (exc, getattr(exc, 'response', None), getattr(exc, 'resp', None)):
+        for attr in ('status_code', 'status'):
+            value = getattr(candidate, attr, None)
+            if isinstance(value, int):
+                return value
+            if isinstance(value, str) and value.isdigit():
+                return int(value)
+    return None
+
+
+def is_retryable(exc):
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    code = status_code(exc)
+    return code is not None and (code == 429 or 500 <= code < 600)
+
+
+class RequestScheduler:
+    """Routes calls to external APIs through per-provider token buckets, quota
+    budgets and retry with jittered exponential backoff on 429/5xx."""
+
+    def __init__(self, limits, max_retries=4, base_delay=1.0, max_delay=30.0, store=None, reserves=None):
+        # store: a SQLiteLimitStore to share the buckets between processes;
+        # reserves: {provider: tokens} that lower-priority calls leave in the bucket
+        reserves = reserves or {}
+        self.buckets = {provider: TokenBucket(rate, capacity, store, provider, reserves.get(provider, 0))
+                        for provider, (rate, capacity) in limits.items()}
+        self.quotas = {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = {provider: 0 for provider in limits}
+        self.retries = {provider: 0 for provider in limits}
+        self.failures = {provider: 0 for provider in limits}
+        self._lock = threading.Lock()
+
+    def set_quota(self, provider, budget):
+        self.quotas[provider] = budget
+
+    def _count(self, counter, provider):
+        with self._lock:
+            counter[provider] = counter.get(provider, 0) + 1
+
+    def call(self, provider, fn, *args, units=1, priority=None, timeout=None, **kwargs):
+        # units: quota units charged per attempt; timeout: max seconds to wait for a rate limit slot
+        if priority is None:
+            priority = _request_priority.get()
+        bucket = self.buckets.get(provider)
+        quota = self.quotas.get(provider)
+        for attempt in range(self.max_retries + 1):
+            if bucket:
+                bucket.acquire(1, priority, timeout)
+            if quota:
+                quota.charge(units)
+                inc('quota_units_total', units, provider=provider)
+            self._count(self.calls, provider)
+            inc('external_calls_total', provider=provider)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._count(self.failures, provider)
+                    inc('external_failures_total', provider=provider)
+                    raise
+                self._count(self.retries, provider)
+                inc('external_retries_total', provider=provider)
+                # Full jitter keeps concurrent retries from synchronizing
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def stats(self):
+        return {
+            provider: {
+                'calls': self.calls.get(provider, 0),
+                'retries': self.retries.get(provider, 0),
+                'failures': self.failures.get(provider, 0),
+                **({'quota_used': self.quotas[provider].used, 'quota_remaining': self.quotas[provider].remaining}
+                   if provider in self.quotas else {}),
+            }
+            for provider in self.buckets
+        }
+
+
+def merge_scheduler_stats(stats):
+    # Totals over stats() of schedulers in several processes. Quota usage lives
+    # in the shared limit store, so every process reports the same figures.
+    merged = {}
+    for process_stats in stats:
+        for provider, counts in process_stats.items():
+            if provider not in merged:
+                merged[provider] = dict(counts)
+                continue
+            for counter in ('calls', 'retries', 'failures'):
+                merged[provider][counter] += counts[counter]
+    return merged
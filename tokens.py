@@ -0,0 +1,92 @@
+import functools
+import os
+import re
+import sys
+
+# Estimate for English text when tiktoken or its encoding file is unavailable
+CHARS_PER_TOKEN = 4
+# tiktoken downloads encoding files on first use and keeps them here; warm the
+# directory ahead of time (python tokens.py) so loading needs no network
+os.environ.setdefault('TIKTOKEN_CACHE_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.cache', 'tiktoken'))
+
+LINK_PATTERN = re.compile(r'(?:https?://|www\.)\S+')
+WHITESPACE_PATTERN = re.compile(r'[ \t\r\f\v]+')
+
+
+@functools.lru_cache(maxsize=8)
+def get_encoding(model):
+    # tiktoken encoding for the model (cl100k_base for unknown models), or None
+    # when tiktoken is not installed or the encoding file cannot be downloaded.
+    # None is cached too, so a failed load is not retried on every prompt.
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+def count_tokens(text, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model, marker='...'):
+    # Cut text to at most max_tokens (plus the marker), at a word boundary when possible
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+    encoding = get_encoding(model)
+    if encoding is None:
+        cut = text[:max_tokens * CHARS_PER_TOKEN]
+    else:
+        cut = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    if ' ' in cut.strip():
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' \n,;:-') + marker
+
+
+def clean_text(text):
+    # Links carry no signal for the LLM but cost many tokens; runs of spaces and
+    # blank lines are collapsed
+    text = WHITESPACE_PATTERN.sub(' ', LINK_PATTERN.sub('', text or ''))
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def dedupe_lines(texts, seen=()):
+    # Drop lines already seen in an earlier text (or in `seen`): sign-offs, link
+    # lists and sponsor blurbs repeated under every video description
+    seen = {_line_key(line) for text in seen for line in clean_text(text).splitlines()}
+    deduped = []
+    for text in texts:
+        lines = []
+        for line in clean_text(text).splitlines():
+            key = _line_key(line)
+            if key and key not in seen:
+                seen.add(key)
+                lines.append(line)
+        deduped.append('\n'.join(lines))
+    return deduped
+
+
+def _line_key(line):
+    return ' '.join(re.sub(r'[^\w\s]', '', line.lower()).split())
+
+
+def main():
+    # Download the encodings for the given models (default LLM_MODEL) into
+    # TIKTOKEN_CACHE_DIR, e.g. before the web and worker processes start
+    for model in sys.argv[1:] or [os.getenv('LLM_MODEL', 'gpt-3.5-turbo')]:
+        if get_encoding(model) is None:
+            sys.exit(f"Could not load the tiktoken encoding for {model}; token counts will be estimated")
+        print(f"tiktoken encoding for {model} cached in {os.environ['TIKTOKEN_CACHE_DIR']}")
+
+
+if __name__ == '__main__':
+    main()
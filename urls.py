@@ -0,0 +1,160 @@
+import functools
+import re
+from collections import namedtuple
+from urllib.parse import parse_qs
+
+
+class ProfileRef(namedtuple('ProfileRef', ['platform', 'kind', 'identifier'])):
+    """Canonical reference to a creator profile parsed from a URL.
+
+    kind is how the platform identifies the profile: 'username' (Instagram,
+    Twitter, TikTok) or, on YouTube, 'channel_id', 'handle', 'username'
+    (legacy /user/ URLs), 'custom' (/c/ and bare custom URLs) or 'video'
+    (a video of the channel). Identifiers are normalized (lowercased unless
+    case-sensitive), so `key` is stable across spellings of the same URL.
+    """
+
+    __slots__ = ()
+
+    @property
+    def key(self):
+        return f'{self.platform}:{self.kind}:{self.identifier}'
+
+    @property
+    def url(self):
+        return PROFILE_URL_FORMATS[self.platform, self.kind].format(self.identifier)
+
+
+PROFILE_URL_FORMATS = {
+    ('instagram', 'username'): 'https://www.instagram.com/{}/',
+    ('youtube', 'channel_id'): 'https://www.youtube.com/channel/{}',
+    ('youtube', 'handle'): 'https://www.youtube.com/{}',
+    ('youtube', 'username'): 'https://www.youtube.com/user/{}',
+    ('youtube', 'custom'): 'https://www.youtube.com/c/{}',
+    ('youtube', 'video'): 'https://www.youtube.com/watch?v={}',
+    ('twitter', 'username'): 'https://x.com/{}',
+    ('tiktok', 'username'): 'https://www.tiktok.com/@{}',
+}
+
+# Exact hosts (after dropping www./m./mobile.) -> platform; substrings such as
+# "x.com" inside "netflix.com" never match
+PLATFORM_HOSTS = {
+    'instagram.com': 'instagram',
+    'instagr.am': 'instagram',
+    'youtube.com': 'youtube',
+    'music.youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'twitter.com': 'twitter',
+    'x.com': 'twitter',
+    'tiktok.com': 'tiktok',
+}
+HOST_PREFIXES = ('www.', 'm.', 'mobile.')
+
+# scheme, host, path and query in one match; cheaper than urlsplit and strict
+# enough here because the host must then be one of PLATFORM_HOSTS
+URL_PATTERN = re.compile(
+    r'(?:(?P<scheme>[A-Za-z][A-Za-z0-9+.-]*)://)?(?:[^@/?#\s]*@)?(?P<host>[^/?#:\s]+)(?::\d+)?'
+    r'(?P<path>/[^?#\s]*)?(?:\?(?P<query>[^#\s]*))?(?:#\S*)?'
+)
+
+INSTAGRAM_USERNAME = re.compile(r'[a-z0-9._]{1,30}')
+# Paths that are not profiles; stories/<username>/ is handled separately
+INSTAGRAM_RESERVED = frozenset({
+    'p', 'reel', 'reels', 'tv', 'explore', 'accounts', 'direct', 'about', 'developer', 'legal', 'web',
+})
+YOUTUBE_CHANNEL_ID = re.compile(r'UC[A-Za-z0-9_-]{22}')
+YOUTUBE_HANDLE = re.compile(r'[\w.-]{3,30}')
+YOUTUBE_NAME = re.compile(r'[\w.-]{1,100}')
+YOUTUBE_VIDEO_ID = re.compile(r'[A-Za-z0-9_-]{11}')
+YOUTUBE_RESERVED = frozenset({
+    'watch', 'shorts', 'live', 'embed', 'playlist', 'results', 'feed', 'channel', 'user', 'c',
+    'account', 'premium', 'gaming', 'music', 'kids', 'hashtag', 'redirect', 'about', 't', 'post',
+})
+TWITTER_USERNAME = re.compile(r'[a-z0-9_]{1,15}')
+TWITTER_RESERVED = frozenset({
+    'home', 'i', 'search', 'explore', 'intent', 'share', 'hashtag', 'settings', 'messages',
+    'notifications', 'compose', 'login', 'signup', 'tos', 'privacy', 'about',
+})
+TIKTOK_USERNAME = re.compile(r'[a-z0-9._]{2,24}')
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_profile_url(url):
+    # Returns a ProfileRef, or None when the URL is not a recognizable profile.
+    # Memoized: the same URL is routed by the UI, the batch runner and the caches.
+    match = URL_PATTERN.fullmatch(url.strip())
+    if match is None or (match['scheme'] or 'https').lower() not in ('http', 'https'):
+        return None
+    host = match['host'].lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    platform = PLATFORM_HOSTS.get(host)
+    if platform is None:
+        return None
+    segments = [segment for segment in (match['path'] or '').split('/') if segment]
+    if platform == 'instagram':
+        return _instagram(segments)
+    if platform == 'youtube':
+        return _youtube(host, segments, match['query'] or '')
+    if platform == 'twitter':
+        return _twitter(segments)
+    return _tiktok(segments)
+
+
+def _instagram(segments):
+    if len(segments) >= 2 and segments[0] == 'stories':
+        segments = segments[1:]
+    if not segments:
+        return None
+    username = segments[0].lstrip('@').lower()
+    if username in INSTAGRAM_RESERVED or not INSTAGRAM_USERNAME.fullmatch(username):
+        return None
+    return ProfileRef('instagram', 'username', username)
+
+
+def _youtube(host, segments, query):
+    if host == 'youtu.be':
+        if segments and YOUTUBE_VIDEO_ID.fullmatch(segments[0]):
+            return ProfileRef('youtube', 'video', segments[0])
+        return None
+    if not segments:
+        return None
+    first = segments[0]
+    if first.startswith('@'):
+        handle = first[1:].lower()
+        return ProfileRef('youtube', 'handle', '@' + handle) if YOUTUBE_HANDLE.fullmatch(handle) else None
+    if len(segments) >= 2 and first == 'channel':
+        # Channel IDs are case-sensitive
+        return ProfileRef('youtube', 'channel_id', segments[1]) if YOUTUBE_CHANNEL_ID.fullmatch(segments[1]) else None
+    if len(segments) >= 2 and first in ('user', 'c'):
+        name = segments[1].lower()
+        if not YOUTUBE_NAME.fullmatch(name):
+            return None
+        return ProfileRef('youtube', 'username' if first == 'user' else 'custom', name)
+    if first == 'watch':
+        video_id = parse_qs(query).get('v', [''])[0]
+        return ProfileRef('youtube', 'video', video_id) if YOUTUBE_VIDEO_ID.fullmatch(video_id) else None
+    if len(segments) >= 2 and first in ('shorts', 'live', 'embed'):
+        return ProfileRef('youtube', 'video', segments[1]) if YOUTUBE_VIDEO_ID.fullmatch(segments[1]) else None
+    if first.lower() in YOUTUBE_RESERVED or not YOUTUBE_NAME.fullmatch(first):
+        return None
+    # youtube.com/<name> is a legacy custom URL
+    return ProfileRef('youtube', 'custom', first.lower())
+
+
+def _twitter(segments):
+    if not segments:
+        return None
+    username = segments[0].lstrip('@').lower()
+    if username in TWITTER_RESERVED or not TWITTER_USERNAME.fullmatch(username):
+        return None
+    return ProfileRef('twitter', 'username', username)
+
+
+def _tiktok(segments):
+    if not segments or not segments[0].startswith('@'):
+        return None
+    username = segments[0][1:].lower()
+    return ProfileRef('tiktok', 'username', username) if TIKTOK_USERNAME.fullmatch(username) else None
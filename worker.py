@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+import app
+
+# Token events are merged and written at most this often, so a streamed
+# generation costs a handful of rows instead of one per token
+TOKEN_FLUSH_INTERVAL = 0.25
+
+
+async def run_job(queue, job):
+    # Run one analysis, appending its events to the job's log
+    tokens = []
+    flushed_at = time.monotonic()
+    error = None
+
+    def flush_tokens():
+        if tokens:
+            queue.add_event(job['id'], {'type': 'token', 'url': job['url'], 'text': ''.join(tokens)})
+            tokens.clear()
+
+    # Creator jobs carry one profile URL per line
+    urls = job['url'].split('\n')
+    engine = app.AnalysisEngine(os.getenv('OPENAI_API_KEY'))
+    try:
+        events = engine.analyze_creator(urls) if len(urls) > 1 else engine.analyze(job['url'])
+        async for event in events:
+            if event['type'] == 'token':
+                tokens.append(event['text'])
+                if time.monotonic() - flushed_at < TOKEN_FLUSH_INTERVAL:
+                    continue
+            await asyncio.to_thread(flush_tokens)
+            flushed_at = time.monotonic()
+            if event['type'] == 'error':
+                error = event['message']
+            if event['type'] != 'token':
+                await asyncio.to_thread(queue.add_event, job['id'], app.encode_event(event))
+        await asyncio.to_thread(flush_tokens)
+    except Exception as e:
+        error = f'Analysis failed: {e}'
+        await asyncio.to_thread(queue.add_event, job['id'],
+                                {'type': 'error', 'url': job['url'], 'stage': 'worker', 'message': error})
+    await asyncio.to_thread(queue.finish, job['id'], error)
+
+
+async def serve(worker_id, concurrency, poll_interval):
+    queue = app.get_job_queue()
+    running = {}
+
+    async def heartbeat():
+        # Renew the leases of running jobs well before they expire
+        while True:
+            await asyncio.to_thread(queue.heartbeat, list(running.values()), worker_id)
+            await asyncio.sleep(min(app.JOB_LEASE_SECONDS / 4, 10))
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        while True:
+            while len(running) < concurrency:
+                job = await asyncio.to_thread(queue.claim, worker_id)
+                if job is None:
+                    break
+                print(f'[{worker_id}] {job["id"]} {job["url"]}', flush=True)
+                running[asyncio.create_task(run_job(queue, job))] = job['id']
+            if running:
+                finished, _ = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    del running[task]
+                    task.result()
+            else:
+                await asyncio.sleep(poll_interval)
+    finally:
+        heartbeat_task.cancel()
+
+
+def worker_main(index, concurrency, poll_interval):
+    worker_id = f'{socket.gethostname()}-{os.getpid()}-{index}'
+    # The web process shows and exports the metrics workers publish
+    app.start_metrics_publisher(os.getpid())
+    try:
+        asyncio.run(serve(worker_id, concurrency, poll_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued profile analyses in worker processes.')
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='analyses in flight per process')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds between queue polls when idle')
+    args = parser.parse_args()
+
+    if not os.getenv('OPENAI_API_KEY'):
+        sys.exit('OPENAI_API_KEY is not set')
+
+    processes = [
+        multiprocessing.Process(target=worker_main, args=(index, args.concurrency, args.poll_interval),
+                                name=f'analysis-worker-{index}')
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()